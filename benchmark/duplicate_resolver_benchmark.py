@@ -0,0 +1,32 @@
+''' Time duplicate_column_checker over increasing numbers of rows to
+    demonstrate that it scales linearly with the size of the cohort.
+
+Usage:
+    python benchmark/duplicate_resolver_benchmark.py
+'''
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from snsTools import duplicate_resolver as dr
+from synthetic import synthetic_cohort
+
+
+def time_checker(n, repeat=3):
+    ''' Return the best wall time in seconds of duplicate_column_checker over n rows
+    '''
+    df = synthetic_cohort(n)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        dr.duplicate_column_checker(df, ['Sex', 'Status'])
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    print("{:>10} {:>12} {:>14}".format('rows', 'seconds', 'us per row'))
+    for n in [10**3, 10**4, 10**5, 2*10**5, 10**6]:
+        seconds = time_checker(n)
+        print("{:>10} {:>12.4f} {:>14.3f}".format(n, seconds, seconds / n * 1e6))
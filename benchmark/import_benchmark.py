@@ -0,0 +1,47 @@
+''' Measure the cold import time of the data-only tools and fail if it goes over
+    budget or if any of the plotting dependencies are imported along the way.
+
+Usage:
+    python benchmark/import_benchmark.py [budget in seconds]
+'''
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DATA_MODULES = ['data_manipulations', 'duplicate_resolver', 'next_most_damaging']
+HEAVY_MODULES = ['matplotlib', 'scipy', 'PIL']
+
+# run in a fresh interpreter so nothing is already imported
+SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import snsTools
+{imports}
+print(time.perf_counter() - start)
+print(" ".join(m for m in {heavy!r} if m in sys.modules))
+'''
+
+
+def cold_import():
+    ''' Return the seconds taken to import the data-only tools in a fresh
+        interpreter and the heavy modules that were imported with them
+    '''
+    imports = "\n".join("snsTools.{}".format(m) for m in DATA_MODULES)
+    script = SCRIPT.format(imports=imports, heavy=HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=ROOT, universal_newlines=True)
+    lines = output.split('\n')
+    return float(lines[0]), lines[1].split()
+
+
+if __name__ == '__main__':
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    seconds = min(cold_import()[0] for _ in range(3))
+    heavy = cold_import()[1]
+
+    print("cold import of {}: {:.3f}s (budget {:.3f}s)".format(", ".join(DATA_MODULES), seconds, budget))
+    if heavy:
+        sys.exit("FAIL: data-only tools imported {}".format(", ".join(heavy)))
+    if seconds > budget:
+        sys.exit("FAIL: cold import is over budget")
+    print("PASS")
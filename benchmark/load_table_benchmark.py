@@ -0,0 +1,44 @@
+''' Compare the load time and peak memory of reading a whole variant table
+    with pandas against load_table reading only the columns needed by
+    next_most_damaging as categories.
+
+Usage:
+    python benchmark/load_table_benchmark.py [rows]
+'''
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from snsTools import data_manipulations as dm
+from synthetic import measure, synthetic_variants
+
+COLUMNS = ['Sample', 'Symbol', 'Exon', 'AB', 'CADD']
+
+
+def write_variant_table(f, n, seed=0):
+    ''' Write a variant table with n rows and a number of columns
+        that next_most_damaging does not need.
+    '''
+    rng = np.random.RandomState(seed)
+    df = synthetic_variants(n, seed=seed)
+    df['Consequence'] = rng.choice(['missense_variant', 'stop_gained', 'synonymous_variant'], size=n)
+    df['HGVSc'] = ["c.{}A>G".format(i) for i in rng.randint(1, 5000, size=n)]
+    df['Filter'] = rng.choice(['PASS', 'LowQual'], size=n)
+    df.to_csv(f, index=False)
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10**6
+    with tempfile.TemporaryDirectory() as tmp:
+        f = os.path.join(tmp, 'variants.csv')
+        write_variant_table(f, n)
+
+        print("{:>12} {:>10} {:>12} {:>12}".format('loader', 'seconds', 'peak MB', 'frame MB'))
+        for name, func in [('read_csv', lambda: pd.read_csv(f)),
+                           ('load_table', lambda: dm.load_table(f, COLUMNS, numeric=['AB', 'CADD']))]:
+            df, seconds, peak = measure(func)
+            size = df.memory_usage(deep=True).sum() / 2**20
+            print("{:>12} {:>10.3f} {:>12.1f} {:>12.1f}".format(name, seconds, peak, size))
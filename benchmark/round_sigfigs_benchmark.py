@@ -0,0 +1,47 @@
+''' Compare the time and peak memory of RoundToSigFigs against the
+    original implementation which rounds the whole array at once.
+
+The results are not identical: the original kept only sigfigs-1 digits
+when the mantissa it rounded was below 1 (978.74 became 980 at 3 sigfigs,
+not 979), which RoundToSigFigs fixes. The share of values that differ for
+this reason is printed for each dtype.
+
+Usage:
+    python benchmark/round_sigfigs_benchmark.py [size]
+'''
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from snsTools import plot_manipulations as pm
+from synthetic import measure
+
+
+def original_round_to_sig_figs(x, sigfigs):
+    ''' RoundToSigFigs as it was before chunking, kept as a reference
+    '''
+    __logBase10of2 = 3.010299956639811952137388947244930267681898814621085413104274611e-1
+    if not np.all(np.isreal(x)):
+        raise TypeError("RoundToSigFigs: all x must be real.")
+    mantissas, binaryExponents = np.frexp(x)
+    decimalExponents = __logBase10of2 * binaryExponents
+    intParts = np.floor(decimalExponents)
+    mantissas *= 10.0**(decimalExponents - intParts)
+    return np.around(mantissas, decimals=sigfigs - 1) * 10.0**intParts
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5 * 10**6
+    print("{:>10} {:>26} {:>10} {:>10}".format('dtype', 'implementation', 'seconds', 'peak MB'))
+    for dtype in [np.float64, np.float32]:
+        x = (np.random.RandomState(0).standard_normal(n) * 1000).astype(dtype)
+        out = np.empty_like(x)
+        runs = [('original', lambda: original_round_to_sig_figs(x, 3)),
+                ('RoundToSigFigs', lambda: pm.RoundToSigFigs(x, 3)),
+                ('RoundToSigFigs(out=)', lambda: pm.RoundToSigFigs(x, 3, out=out))]
+        for name, func in runs:
+            _, seconds, peak = measure(func)
+            print("{:>10} {:>26} {:>10.3f} {:>10.1f}".format(np.dtype(dtype).name, name, seconds, peak))
+        differ = np.mean(original_round_to_sig_figs(x, 3).astype(dtype) != pm.RoundToSigFigs(x, 3))
+        print("{:>10} {:>26} {:>21.1%}".format(np.dtype(dtype).name, 'differ from original', differ))
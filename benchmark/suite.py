@@ -0,0 +1,122 @@
+''' Time and memory profile every tool over synthetic data of increasing size
+    and write the results as JSON so runs can be compared for regressions.
+
+Usage:
+    python benchmark/suite.py --output results.json
+    python benchmark/suite.py --max-rows 10000000 --max-images 400 --output results.json
+    python benchmark/suite.py --output new.json --compare old.json
+'''
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+import pandas as pd
+import snsTools
+import synthetic
+
+ROW_SIZES = [10**3, 10**4, 10**5, 10**6, 10**7]
+IMAGE_SIZES = [4, 40, 400]
+
+
+def row_benchmarks(n, seed):
+    ''' Get the name and function of each table benchmark over n rows
+    '''
+    dr = snsTools.duplicate_resolver
+    nmd = snsTools.next_most_damaging
+    dm = snsTools.data_manipulations
+    gp = snsTools.grouped_piechart
+
+    cohort = synthetic.synthetic_cohort(n, seed=seed)
+    variants = synthetic.synthetic_variants(n, seed=seed)
+    old = synthetic.most_damaging(variants)
+    terms = dict((term, term.upper()) for term in synthetic.PHENOTYPES)
+
+    def piechart():
+        ax = gp.grouped_piechart(cohort[cohort['Status'].isin(['case', 'control'])], 'Status', 'Sex')
+        gp.plt.close(ax.figure)
+
+    return [('duplicate_resolver', lambda: dr.duplicate_resolver(cohort, 'Sample', ['Sex', 'Status'], warn=False)),
+            ('next_most_damaging', lambda: nmd.next_most_damaging(old, variants, score='CADD')),
+            ('replace_series_strings', lambda: dm.replace_series_strings(cohort.copy(), 'Phenotype', terms, single_pass=True)),
+            ('grouped_piechart', piechart)]
+
+
+def run(max_rows, max_images, memory=True, seed=0):
+    ''' Run all benchmarks up to the given sizes
+
+    Returns:
+        list of result dictionaries with the keys tool, size, seconds and peak_mb
+    '''
+    results = []
+
+    for n in [size for size in ROW_SIZES if size <= max_rows]:
+        for tool, func in row_benchmarks(n, seed):
+            _, seconds, peak = synthetic.measure(func, memory)
+            results.append({'tool': tool, 'size': n, 'seconds': seconds, 'peak_mb': peak})
+            report(results[-1])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = synthetic.synthetic_images(max([size for size in IMAGE_SIZES if size <= max_images] or [0]), tmp, seed=seed)
+        for n in [size for size in IMAGE_SIZES if size <= max_images]:
+            rows = max(1, int(np.sqrt(n / 2)))
+            outfile = os.path.join(tmp, 'mosaic.png')
+            func = lambda: snsTools.plot_manipulations.create_subplot(files[:n], outfile, rows=rows)
+            _, seconds, peak = synthetic.measure(func, memory)
+            results.append({'tool': 'create_subplot', 'size': n, 'seconds': seconds, 'peak_mb': peak})
+            report(results[-1])
+
+    return results
+
+
+def report(result):
+    ''' Print a single result
+    '''
+    peak = '' if result['peak_mb'] is None else "{:.1f}".format(result['peak_mb'])
+    print("{:>24} {:>10} {:>10.3f} {:>10}".format(result['tool'], result['size'], result['seconds'], peak))
+
+
+def compare(results, previous):
+    ''' Print the ratio of the time and memory of each result to the previous run
+    '''
+    before = dict(((r['tool'], r['size']), r) for r in previous['results'])
+    print("\n{:>24} {:>10} {:>12} {:>12}".format('tool', 'size', 'time ratio', 'memory ratio'))
+    for r in results:
+        old = before.get((r['tool'], r['size']))
+        if old is None:
+            continue
+        memory = r['peak_mb'] / old['peak_mb'] if r['peak_mb'] and old['peak_mb'] else float('nan')
+        print("{:>24} {:>10} {:>12.2f} {:>12.2f}".format(r['tool'], r['size'], r['seconds'] / old['seconds'], memory))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark snsTools over synthetic data")
+    parser.add_argument('--max-rows', type=int, default=10**5, help='largest table size to benchmark')
+    parser.add_argument('--max-images', type=int, default=40, help='largest number of images to benchmark')
+    parser.add_argument('--no-memory', action='store_true', help='only measure time')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare against')
+    args = parser.parse_args()
+
+    print("{:>24} {:>10} {:>10} {:>10}".format('tool', 'size', 'seconds', 'peak MB'))
+    results = run(args.max_rows, args.max_images, not args.no_memory, args.seed)
+
+    if args.output:
+        meta = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                'numpy': np.__version__, 'pandas': pd.__version__, 'seed': args.seed}
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+''' Seeded generators of synthetic cohort tables, variant tables and image
+    sets for benchmarking the tools, and the measure function the benchmarks
+    time them with
+'''
+import os
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+PHENOTYPES = ['congenital heart defect', 'cleft lip', 'cleft palate', 'seizures',
+              'developmental delay', 'short stature', 'hearing loss', 'none']
+
+
+def synthetic_cohort(n, dup_ends=['_2', '_3', '_pool7A', '_pool10A'], dup_rate=0.2, seed=0):
+    ''' Create a cohort table with n rows in which roughly dup_rate of the
+        samples are duplicates of another sample and phenotype fields are
+        randomly missing.
+
+    Args:
+        n: number of rows
+        dup_ends: endings appended to a sample name to make its duplicate
+        dup_rate: fraction of rows which are duplicates
+        seed: random seed
+
+    Returns:
+        DataFrame with the columns Sample, Sex, Status and Phenotype
+    '''
+    rng = np.random.RandomState(seed)
+    samples = np.array(["GEN{:08d}".format(i) for i in range(n)], dtype=object)
+    dups = rng.rand(n) < dup_rate
+    ends = rng.choice(dup_ends, size=dups.sum())
+    samples[dups] = [s + e for s, e in zip(samples[rng.randint(0, n, size=dups.sum())], ends)]
+    missing = np.array(['-', np.nan], dtype=object)
+    return pd.DataFrame({'Sample': samples,
+                         'Sex': rng.choice(np.append(['Male', 'Female'], missing), size=n),
+                         'Status': rng.choice(np.append(['case', 'control'], missing), size=n),
+                         'Phenotype': rng.choice(PHENOTYPES, size=n)}).drop_duplicates('Sample')
+
+
+def synthetic_variants(n, samples_per_variant=20, genes=2000, seed=0):
+    ''' Create a variant table with n rows spread over n / samples_per_variant samples.
+
+    Args:
+        n: number of rows
+        samples_per_variant: average number of variants per sample
+        genes: number of distinct gene symbols
+        seed: random seed
+
+    Returns:
+        DataFrame with the columns Sample, Symbol, Exon, AB and CADD, sorted by
+        sample and then descending CADD score
+    '''
+    rng = np.random.RandomState(seed)
+    symbols = np.array(["GENE{}".format(i) for i in range(genes - 1)] + ['SKI'], dtype=object)
+    exons = np.array(["{}/7".format(i) for i in range(1, 8)], dtype=object)
+    df = pd.DataFrame({'Sample': ["GEN{:08d}".format(i) for i in rng.randint(0, n // samples_per_variant + 1, size=n)],
+                       'Symbol': symbols[rng.randint(0, genes, size=n)],
+                       'Exon': exons[rng.randint(0, len(exons), size=n)],
+                       'AB': rng.rand(n).round(3),
+                       'CADD': (rng.rand(n) * 40).round(2)})
+    return df.sort_values(['Sample', 'CADD'], ascending=[True, False]).reset_index(drop=True)
+
+
+def most_damaging(variants):
+    ''' Get the first, highest scoring, variant of each sample
+    '''
+    return variants.drop_duplicates('Sample')
+
+
+def synthetic_images(n, directory, size=(800, 600), seed=0):
+    ''' Write n images of random blocks of colour, alternating between PNG and JPEG.
+
+    Args:
+        n: number of images
+        directory: directory to write the images to
+        size: resolution in pixels in a tuple (width, height)
+        seed: random seed
+
+    Returns:
+        list of image files
+    '''
+    import PIL.Image
+    rng = np.random.RandomState(seed)
+    files = []
+    for i in range(n):
+        blocks = rng.randint(0, 256, size=(size[1] // 50 + 1, size[0] // 50 + 1, 3)).astype(np.uint8)
+        pixels = blocks.repeat(50, axis=0).repeat(50, axis=1)[:size[1], :size[0]]
+        f = os.path.join(directory, "panel{:04d}.{}".format(i, 'png' if i % 2 == 0 else 'jpg'))
+        PIL.Image.fromarray(pixels).save(f)
+        files.append(f)
+    return files
+
+
+def measure(func, memory=True):
+    ''' Return the result, wall time in seconds and peak traced memory in MB of func
+
+    Notes:
+        func is run twice when measuring memory as tracing allocations slows it down.
+        Only allocations made through Python and numpy are traced, so image buffers 
+        allocated inside PIL are not included. The peak is None when memory is False.
+    '''
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    return result, seconds, peak
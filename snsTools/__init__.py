@@ -0,0 +1,24 @@
+''' A set of tools to simplify common tasks performed in Pandas, Matplotlib & Seaborn
+
+Submodules are imported on first access, so the data-only tools
+(data_manipulations, duplicate_resolver and next_most_damaging) can be
+used without importing matplotlib, PIL or scipy e.g.
+
+    import snsTools
+    df = snsTools.duplicate_resolver.duplicate_resolver(df, "Sample", ["Sex"])
+'''
+import importlib
+
+__all__ = ['data_manipulations', 'duplicate_resolver', 'next_most_damaging',
+           'association_tests', 'instrumentation', 'plot_manipulations', 'grouped_piechart', 'batch_images',
+           'render_daemon', 'render_cache']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,127 @@
+''' Test many categorical columns for association with a grouping column
+    without drawing anything
+'''
+import hashlib
+import os
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+# results of the latest calls, the least recently used are dropped beyond CACHE_SIZE
+CACHE_SIZE = 128
+_cache = OrderedDict()
+
+
+def association_test(table):
+    ''' Test the association between the rows and columns of a table of counts
+        using fisher's exact test for two rows and two columns and chi2 otherwise.
+
+    Args:
+        table: DataFrame of counts, see grouped_piechart.piechart_table
+
+    Returns:
+        pvalue
+    '''
+    return _association_test(table)[2]
+
+
+def _association_test(table):
+    # returns the test name, its statistic and the pvalue
+    array = table.values.tolist()
+    if table.shape == (2, 2):
+        oddsratio, pvalue = stats.fisher_exact(array)
+        return 'fisher', oddsratio, pvalue
+    chi2, pvalue, dof, expected = stats.chi2_contingency(array)
+    return 'chi2', chi2, pvalue
+
+
+def association_tests(df, group, quals, correction='fdr_bh', cache_dir=None):
+    ''' Test every qual column for an association with the group column.
+
+    Args:
+        df: Pandas DataFrame
+        group: a column in df containing categorical data
+        quals: list of columns in df containing categorical data
+        correction: multiple testing correction, 'fdr_bh', 'bonferroni' or None
+        cache_dir: directory to store results in so they can be reused by later runs
+
+    Returns:
+        DataFrame with a row per qual and the columns qual, group, test,
+        statistic, pvalue, p_adjusted and n
+
+    Notes:
+        Rows without a group are dropped and missing quals are counted as
+        Unknown, the same as grouped_piechart. Results are cached by a hash
+        of the group and qual columns and the arguments, in memory for the
+        latest CACHE_SIZE calls. Fisher's exact test is used for 2x2 tables
+        and chi2 for all others, so the group column may have any number of
+        levels.
+    '''
+    data = df[[group] + list(quals)]
+    key = _input_hash(data, group, quals, correction)
+
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key].copy()
+    path = os.path.join(cache_dir, key + '.pkl') if cache_dir else None
+    if path and os.path.exists(path):
+        remember(key, pd.read_pickle(path))
+        return _cache[key].copy()
+
+    data = data.dropna(subset=[group])
+    results = []
+    for qual in quals:
+        # one crosstab per qual column gives the whole contingency table
+        table = pd.crosstab(data[group], data[qual].fillna('Unknown'))
+        test, statistic, pvalue = _association_test(table)
+        results.append((qual, group, test, statistic, pvalue, int(table.values.sum())))
+
+    results = pd.DataFrame(results, columns=['qual', 'group', 'test', 'statistic', 'pvalue', 'n'])
+    results.insert(5, 'p_adjusted', adjust_pvalues(results['pvalue'].values, correction))
+
+    remember(key, results)
+    if path:
+        os.makedirs(cache_dir, exist_ok=True)
+        results.to_pickle(path)
+    return results.copy()
+
+
+def remember(key, results):
+    # add results to the in memory cache, dropping the least recently used beyond CACHE_SIZE
+    _cache[key] = results
+    _cache.move_to_end(key)
+    while len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+
+
+def adjust_pvalues(pvalues, correction='fdr_bh'):
+    ''' Correct pvalues for multiple testing.
+
+    Args:
+        pvalues: array of pvalues
+        correction: 'fdr_bh' (Benjamini-Hochberg), 'bonferroni' or None
+
+    Returns:
+        array of adjusted pvalues
+    '''
+    pvalues = np.asarray(pvalues, dtype=float)
+    n = len(pvalues)
+    if correction is None or n == 0:
+        return pvalues
+    if correction == 'bonferroni':
+        return np.minimum(pvalues * n, 1.0)
+    if correction == 'fdr_bh':
+        order = np.argsort(pvalues)[::-1]
+        ranked = pvalues[order] * n / np.arange(n, 0, -1)
+        adjusted = np.empty(n)
+        adjusted[order] = np.minimum(np.minimum.accumulate(ranked), 1.0)
+        return adjusted
+    raise ValueError("adjust_pvalues: unknown correction '{}'".format(correction))
+
+
+def _input_hash(data, group, quals, correction):
+    # hash the values of the columns along with their names and the arguments
+    digest = hashlib.sha1(pd.util.hash_pandas_object(data, index=False).values.tobytes())
+    digest.update(repr((group, list(quals), list(data.columns), correction)).encode())
+    return digest.hexdigest()
@@ -0,0 +1,138 @@
+''' Run figure post-processing operations over many images in a process pool
+
+Usage:
+    python -m snsTools.batch_images manifest.json --workers 8
+
+The manifest is a JSON list of operations, each a dictionary with an "op" key:
+    {"op": "grayscale", "input": "a.png", "output": "a_gray.png"}
+    {"op": "caption", "input": "a.png", "output": "a_box.png", "msg": "Figure 1. ..."}
+    {"op": "mosaic", "inputs": ["a.png", "b.png"], "output": "ab.png", "rows": 1}
+    {"op": "piechart", "data": "cohort.csv", "group": "Status", "qual": "Sex", "output": "pie.png"}
+
+Any other keys are passed on as arguments to convert2grayscale, figure_box,
+create_subplot and grouped_piechart respectively, except for the "sep" of a
+piechart's csv. Stages are run in the order they first
+appear in the manifest and each stage finishes before the next begins, so
+a later stage can use the outputs of an earlier one.
+'''
+import argparse
+import json
+import os
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from itertools import repeat
+from . import plot_manipulations as pm
+from . import render_cache
+
+
+def run_operation(task):
+    ''' Run a single manifest operation.
+
+    Args:
+        task: dictionary describing the operation
+
+    Returns:
+        the operation name and the seconds it took in a tuple
+    '''
+    task = dict(task)
+    op = task.pop('op')
+    start = time.perf_counter()
+
+    if op == 'grayscale':
+        pm.convert2grayscale(task.pop('input'), task.pop('output', None), **task)
+    elif op == 'caption':
+        pm.figure_box(task.pop('input'), task.pop('msg'), task.pop('output'), **task)
+    elif op == 'mosaic':
+        pm.create_subplot(task.pop('inputs'), task.pop('output'), **task)
+    elif op == 'piechart':
+        from .grouped_piechart import render_piechart
+        f = task.pop('data')
+        df = read_data(f, os.path.getmtime(f), task.pop('sep', ','))
+        render_piechart(df, task.pop('group'), task.pop('qual'), task.pop('output'), **task)
+    else:
+        raise ValueError("run_operation: unknown op '{}'".format(op))
+
+    return op, time.perf_counter() - start
+
+
+@lru_cache(maxsize=8)
+def read_data(f, mtime, sep=','):
+    ''' Read a csv or Parquet table once for every time it is modified, so 
+        piecharts drawn from the same table in a process share it.
+
+    Args:
+        f: csv or Parquet file
+        mtime: modification time of f, only used to invalidate the cache
+        sep: delimiter used in a csv
+
+    Returns:
+        DataFrame, which must not be modified
+    '''
+    import pandas as pd
+    from .data_manipulations import is_parquet
+    if is_parquet(f):
+        return pd.read_parquet(f)
+    return pd.read_csv(f, sep=sep)
+
+
+def run_manifest(manifest, workers=None):
+    ''' Run all the operations in a manifest across a process pool.
+
+    Args:
+        manifest: list of operation dictionaries
+        workers: number of processes, by default the number of CPUs
+
+    Returns:
+        a dictionary where the key is the stage and the item is a
+        tuple of the number of operations and the wall time in seconds
+
+    Notes:
+        the workers use the active render cache, if any, see render_cache
+    '''
+    stages = OrderedDict()
+    for task in manifest:
+        stages.setdefault(task['op'], []).append(task)
+
+    summary = OrderedDict()
+    cache = render_cache.settings()
+    with ProcessPoolExecutor(max_workers=workers, initializer=render_cache.enable if cache else None,
+                             initargs=cache) as pool:
+        for op, tasks in stages.items():
+            start = time.perf_counter()
+            for result, counts in pool.map(render_cache.counted, repeat(run_operation), tasks):
+                render_cache.add_counts(counts)
+            summary[op] = (len(tasks), time.perf_counter() - start)
+
+    return summary
+
+
+def print_summary(summary):
+    ''' Print the throughput of each stage
+    '''
+    print("{:>10} {:>8} {:>10} {:>12}".format('stage', 'images', 'seconds', 'images/sec'))
+    for op, (n, seconds) in summary.items():
+        print("{:>10} {:>8} {:>10.2f} {:>12.1f}".format(op, n, seconds, n / seconds if seconds else 0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('manifest', help='JSON file listing the operations to run')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes')
+    parser.add_argument('--cache', help='directory to cache rendered outputs in')
+    parser.add_argument('--cache-mb', type=float, default=512, help='size of the cache in MB')
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+
+    cache = render_cache.cache_renders(args.cache, args.cache_mb) if args.cache else nullcontext()
+    with cache:
+        summary = run_manifest(manifest, args.workers)
+    print_summary(summary)
+
+
+if __name__ == '__main__':
+    main()
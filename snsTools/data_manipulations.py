@@ -1,5 +1,10 @@
 ''' Collection of functions to manipulate common tasks in Pandas DataFrames
 '''
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
 import pandas as pd
 
 def convert2category(column, label_order):
@@ -9,25 +14,124 @@ def convert2category(column, label_order):
     structured_cat = convert.cat.set_categories(label_order)
     return structured_cat
 
-def replace_series_strings(df, col, dic, substring=True):
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+
+def is_parquet(f):
+    ''' Whether the given file name or path has a parquet extension
+    '''
+    if isinstance(f, os.PathLike):
+        f = os.fspath(f)
+    return isinstance(f, str) and f.lower().endswith(PARQUET_EXTENSIONS)
+
+def load_table(f, columns, label_orders={}, numeric=['AB'], sep=',', filters=None):
+    ''' Read only the given columns of a cohort or variant table with all
+        string columns stored as categories.
+
+    Args:
+        f: delimited or parquet (.parquet or .pq) file to read
+        columns: the columns needed by the tool the table will be given to
+        label_orders: a dictionary where the key is a column and the item 
+                      is the order of its labels
+        numeric: columns to convert to numbers, missing columns are ignored
+        sep: delimiter used in the file
+        filters: parquet only, row filters pushed down to the reader e.g.
+                 [('Sample', 'in', samples)]
+
+    Returns:
+        DataFrame with the given columns in the given order
+
+    Example:
+        cohort = load_table("cohort.csv", ["Sample", "Sex", "Status"], numeric=[])
+        cohort = duplicate_resolver(cohort, "Sample", ["Sex", "Status"])
+
+        old = load_table("most_damaging.csv", ["Sample", "Symbol", "Exon", "AB", "CADD"])
+        variants = load_table("all_variants.parquet", ["Sample", "Symbol", "Exon", "AB", "CADD"])
+        new = next_most_damaging(old, variants, score="CADD")
+
+    Notes:
+        reading parquet files requires pyarrow
+    '''
+    numeric = [col for col in numeric if col in columns]
+    categorical = [col for col in columns if col not in numeric]
+
+    if is_parquet(f):
+        df = pd.read_parquet(f, columns=columns, filters=filters)
+        for col in categorical:
+            if df[col].dtype.name != 'category':
+                df[col] = df[col].astype('category')
+    elif filters is not None:
+        raise ValueError("load_table: filters can only be used with parquet files.")
+    else:
+        dtypes = dict((col, 'category') for col in categorical)
+        df = pd.read_csv(f, sep=sep, usecols=columns, dtype=dtypes)
+
+    for col, order in label_orders.items():
+        df[col] = convert2category(df[col], order)
+
+    for col in numeric:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    return df[columns]
+
+def write_table(df, f, sep=','):
+    ''' Write a table as parquet if f has a parquet extension, else as a delimited file.
+
+    Args:
+        df: DataFrame to write
+        f: output file
+        sep: delimiter used for delimited files
+
+    Notes:
+        parquet keeps the column dtypes, including categories, so later steps 
+        can read the table back without parsing any text
+    '''
+    if is_parquet(f):
+        df.to_parquet(f, index=False)
+    else:
+        df.to_csv(f, sep=sep, index=False)
+
+def replace_series_strings(df, col, dic, substring=None, single_pass=False):
     ''' Replace the the keys with the items of the given 
         dictionary for all strings or substrings in a
         given column
 
     Args:
         col: column name to replace strings
-        dic: dictionary where the key is the string to replace with the item
+        dic: dictionary where the key is the string to replace with the item,
+             or a matcher returned by compile_replacements
         substrings: search and replace for either substrings (True) or any cell 
-                    containing the given key (False)
+                    containing the given key (False), by default True or the
+                    setting dic was compiled with
+        single_pass: compile all keys into one matcher and replace them in a 
+                     single pass over the unique values of the column
 
     Returns:
         dataframe with the given column having all the
         entries identified as the key in the given dict
         replaced with the item in said dict
+
+    Notes:
+        In single pass mode keys are matched literally rather than as regular
+        expressions and where keys overlap the leftmost, then longest, key wins. 
+        Replacements are not searched again for other keys, unlike the default 
+        mode which replaces each key in turn. A ValueError is raised if substring
+        differs from the setting dic was compiled with.
     '''
-    if not isinstance(substring, bool):
+    if substring is not None and not isinstance(substring, bool):
         raise TypeError("substring argument must equal True or False")
 
+    if isinstance(dic, Replacements):
+        if substring is not None and substring != dic.substring:
+            raise ValueError("replace_series_strings: dic was compiled with substring={}".format(dic.substring))
+    elif substring is None:
+        substring = True
+
+    if single_pass or isinstance(dic, Replacements):
+        if not isinstance(dic, Replacements):
+            dic = compile_replacements(dic, substring)
+        df[col] = apply_replacements(df[col], dic)
+        return df
+
     for string, correction in dic.items():
         if substring is True:
             df[col] = df[col].str.replace(string, correction)
@@ -36,3 +140,61 @@ def replace_series_strings(df, col, dic, substring=True):
 
     return df
 
+
+Replacements = namedtuple('Replacements', ['pattern', 'lookup', 'substring'])
+
+
+def compile_replacements(dic, substring=True):
+    ''' Compile the keys of the given dictionary into one longest match
+        alternation which can be reused across columns and files.
+
+    Args:
+        dic: dictionary where the key is the string to replace with the item
+        substrings: replace only the matching substrings (True) or the whole cell (False)
+
+    Returns:
+        Replacements matcher for use with replace_series_strings
+
+    Notes:
+        matchers are cached so compiling the same dictionary again is free
+    '''
+    return _compile_replacements(tuple(dic.items()), substring)
+
+
+@lru_cache(maxsize=32)
+def _compile_replacements(items, substring):
+    # longer keys come first in the alternation so they take precedence over their own substrings
+    keys = sorted([key for key, correction in items], key=len, reverse=True)
+    pattern = re.compile("|".join(re.escape(key) for key in keys)) if keys else None
+    return Replacements(pattern, dict(items), substring)
+
+
+def apply_replacements(series, replacements):
+    ''' Replace the matches of a compiled matcher in the given series. 
+
+    Args:
+        series: series of strings
+        replacements: Replacements matcher from compile_replacements
+
+    Returns:
+        series with the replacements made, non-string values are left unchanged
+    '''
+    if replacements.pattern is None:
+        return series
+
+    pattern, lookup = replacements.pattern, replacements.lookup
+
+    def replace(value):
+        if not isinstance(value, str):
+            return value
+        if replacements.substring:
+            return pattern.sub(lambda match: lookup[match.group(0)], value)
+        match = pattern.search(value)
+        return lookup[match.group(0)] if match else value
+
+    # each unique value is only replaced once, missing values have a code of -1 and are kept as they are
+    codes, uniques = pd.factorize(series)
+    replaced = np.array([replace(value) for value in uniques] + [None], dtype=object)[codes]
+    missing = codes == -1
+    replaced[missing] = series.values[missing]
+    return pd.Series(replaced, index=series.index, name=series.name)
@@ -1,7 +1,14 @@
 import numpy as np
+import pandas as pd
 import logging
+import math
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from .instrumentation import stage, summarise_values
 
-def duplicate_resolver(df, col, column_list, dup_ends=['_2','_3', '_pool7A', '_pool10A'], warn=True):
+def duplicate_resolver(df, col, column_list, dup_ends=['_2','_3', '_pool7A', '_pool10A'], warn=True, warn_limit=20,
+                       workers=1, partition_size=10**5):
     ''' Identify duplicate values in a given column and forward-fill the 
         missing data in the a given column list and subsequently 
         remove any rows that have missing data in all the cells
@@ -13,6 +20,9 @@ def duplicate_resolver(df, col, column_list, dup_ends=['_2','_3', '_pool7A', '_p
         column_list: the list of columns to check for missing data
         dup_end: characters which seperate the original and duplicate sample
         warn: print a warning detailing the col values
+        warn_limit: maximum number of removed col values to detail, None for all of them
+        workers: number of processes to resolve duplicates with, None for the number of CPUs
+        partition_size: rows per partition when using more than one process
         
     Returns:
         modified df 
@@ -22,21 +32,155 @@ def duplicate_resolver(df, col, column_list, dup_ends=['_2','_3', '_pool7A', '_p
         duplicates
     '''
     # duplicate samples with different phenotype information are dealt with here 
-    df = duplicate_column_checker(df, column_list, column=col)
+    if workers == 1:
+        df = duplicate_column_checker(df, column_list, dup_ends=dup_ends, column=col)
+    else:
+        df = sharded_duplicate_column_checker(df, column_list, dup_ends=dup_ends, column=col,
+                                              workers=workers, partition_size=partition_size)
 
-    # get index numbers for all column in the list and filter out rows that have no data in these fields
-    col_list_ix = [df.columns.get_loc(x) for x in column_list]
-    remove_rows = df.apply(lambda x: identify_null_data(x, col_list_ix), axis=1)
-    new_df = df[remove_rows]
+    # filter out rows that have no data in the fields of the column list
+    with stage('duplicate_resolver', 'filter', df) as record:
+        has_data = null_data_mask(df, column_list)
+        new_df = df[has_data]
+        record['rows_out'] = len(new_df)
     
     # warn user of removed rows 
-    if warn:
-        removed_rows_values = " ".join(df[~remove_rows][col].tolist())
+    if warn and not has_data.all():
+        removed_rows_values = summarise_values(df.loc[~has_data, col], warn_limit)
         logging.warning("The rows containing the following values in column '{}' have been removed:\n{}".format(col, removed_rows_values))
     
     return new_df
 
 
+def incremental_duplicate_resolver(new_df, col, column_list, state_dir, dup_ends=['_2','_3', '_pool7A', '_pool10A'],
+                                   warn=True, warn_limit=20, shards=1024):
+    ''' Add a new batch of rows to a cohort previously resolved by this function, 
+        re-resolving only the duplicate groups that the new rows belong to.
+
+    Args:
+        new_df: DataFrame of the new rows
+        state_dir: directory in which the cohort is stored between batches, created
+                   on the first batch
+        shards: number of files the cohort is hash partitioned into by root sample
+                name, fixed by the first batch
+
+        see duplicate_resolver for all other arguments
+
+    Returns:
+        the rows of the duplicate groups the new rows belong to, as duplicate_resolver
+        would return them for all of the batches given so far concatenated in order
+
+    Notes:
+        Each shard stores every row given so far, as rows with no data can be filled
+        by a later duplicate, and the resolved rows keyed by their root sample name
+        in the same column. A batch only reads and rewrites the shards its groups
+        hash to, so the shards should outnumber the groups of a typical batch.
+        Use resolved_cohort to get the whole resolved cohort. col, column_list and
+        dup_ends must not change between batches. Each shard is replaced atomically
+        but a batch interrupted while writing them leaves some updated, so rebuild
+        the state from all of the batches rather than repeating the interrupted one.
+    '''
+    settings = {'col': col, 'column_list': list(column_list), 'dup_ends': list(dup_ends), 'shards': shards}
+    settings_file = os.path.join(state_dir, 'settings.pkl')
+    if os.path.exists(settings_file):
+        stored = read_pickle(settings_file)
+        if dict(stored, shards=shards) != settings:
+            raise ValueError("incremental_duplicate_resolver: {} was created with {}".format(state_dir, stored))
+        shards = stored['shards']
+    else:
+        os.makedirs(state_dir, exist_ok=True)
+        write_pickle(settings, settings_file)
+
+    new_df = new_df.copy()
+    new_df['same'] = root_sample_names(new_df[col], dup_ends)
+    new_shard = shard_numbers(new_df['same'], shards)
+
+    read = np.unique(new_shard)
+    states = [read_pickle(shard_file(state_dir, i)) for i in read if os.path.exists(shard_file(state_dir, i))]
+    raw = pd.concat([state['raw'] for state in states] + [new_df], ignore_index=True)
+
+    # only the groups of the new rows need resolving again, which all hash to the shards read
+    touched = raw['same'].isin(new_df['same'])
+    changed = duplicate_column_checker(raw[touched], column_list, dup_ends=dup_ends, column=col)
+    # the empty slice of changed keeps the concat valid when none of the shards exist yet
+    kept = pd.concat([state['resolved'] for state in states] + [changed.iloc[:0]], ignore_index=True)
+    resolved = pd.concat([kept[~kept['same'].isin(new_df['same'])], changed], ignore_index=True)
+
+    # groups are never split between the kept and changed rows, so a stable sort gives the full runs order,
+    # which a stable sort by shard keeps within each shard
+    resolved = sort_resolved(resolved, col)
+    raw, resolved = group_shards(raw, shards), group_shards(resolved, shards)
+    for i in read:
+        write_pickle({'raw': raw[i], 'resolved': resolved[i]}, shard_file(state_dir, i))
+
+    return drop_null_rows(changed, col, column_list, warn, warn_limit)
+
+
+def resolved_cohort(state_dir, warn=True, warn_limit=20):
+    ''' Get every resolved row stored by incremental_duplicate_resolver.
+
+    Args:
+        state_dir: directory given to incremental_duplicate_resolver
+
+        see duplicate_resolver for all other arguments
+
+    Returns:
+        the same df as duplicate_resolver would return for all of the batches 
+        given so far concatenated in order
+    '''
+    settings = read_pickle(os.path.join(state_dir, 'settings.pkl'))
+    shards = [read_pickle(shard_file(state_dir, i))['resolved'] for i in range(settings['shards'])
+              if os.path.exists(shard_file(state_dir, i))]
+    resolved = sort_resolved(pd.concat(shards), settings['col'])
+    return drop_null_rows(resolved, settings['col'], settings['column_list'], warn, warn_limit)
+
+
+def shard_numbers(same, shards):
+    # the shard of each root sample name, stable between runs
+    return pd.util.hash_pandas_object(same, index=False).values % shards
+
+
+def group_shards(df, shards):
+    # split df into a frame per shard, keeping the order of the rows within each
+    shard = shard_numbers(df['same'], shards)
+    order = np.argsort(shard, kind='mergesort')
+    df, shard = df.iloc[order].reset_index(drop=True), shard[order]
+    bounds = np.flatnonzero(np.diff(shard)) + 1
+    starts, ends = np.r_[0, bounds], np.r_[bounds, len(df)]
+    return dict((shard[a], df.iloc[a:b]) for a, b in zip(starts, ends))
+
+
+def shard_file(state_dir, i):
+    return os.path.join(state_dir, 'shard{:05d}.pkl'.format(i))
+
+
+def read_pickle(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def write_pickle(obj, path):
+    # write to a temporary file first so a crash never leaves a partial file
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def sort_resolved(df, col):
+    # the order of duplicate_column_checker's output, ties keep their order
+    return df.sort_values(by=['same', col], ascending=[False, True], kind='mergesort').reset_index(drop=True)
+
+
+def drop_null_rows(df, col, column_list, warn, warn_limit):
+    # filter out rows that have no data in the fields of the column list
+    has_data = null_data_mask(df, column_list)
+    if warn and not has_data.all():
+        removed_rows_values = summarise_values(df.loc[~has_data, col], warn_limit)
+        logging.warning("The rows containing the following values in column '{}' have been removed:\n{}".format(col, removed_rows_values))
+    return df[has_data]
+
+
 def identify_null_data(x, col_ix):
     ''' Check whether we have any data in the fields in the given column indexes.
 
@@ -64,9 +208,28 @@ def identify_null_data(x, col_ix):
         return True
 
 
+def null_data_mask(df, column_list):
+    ''' Check whether we have any data in the fields of the given columns for every row at once.
+
+    Args:
+        df: DataFrame
+        column_list: the list of columns to check for missing data
+
+    Returns:
+        boolean series which is False for rows that only have null or dash in 
+        the given columns, else True
+
+    Notes:
+        A vectorised equivalent of applying identify_null_data across the rows
+    '''
+    block = df[column_list]
+    empty = block.isna() | (block == '-')
+    return ~empty.all(axis=1)
+
+
 
 def duplicate_column_checker(df, columns_names, order=False, recurs=2, dup_ends=['_2','_3', '_pool7A', '_pool10A'],
-                             column="Sample"):
+                             column="Sample", same=None):
     ''' Identify duplicate samples and verify whether they have the same data stored in the given columns.
         If one duplicate has NaN in its phenotype fields then copy the phenotype data from the
         other duplicate sample. If there are still differences between them, then report to user.
@@ -74,49 +237,122 @@ def duplicate_column_checker(df, columns_names, order=False, recurs=2, dup_ends=
     Args:
         column_names: a list of column names to be investigated for differences between duplicates
         order: ascending - True or False
-        recurs: utilised to stop the recursive function
+        recurs: number of fill passes; the first pass uses order, all others are ascending
         dup_end: characters which seperate the original and duplicate sample
         column: column in which to search & identify whether samples are duplicates
+        same: series of the root sample names of column in the order of the rows of df
+              if already known, otherwise they are derived with root_sample_names
 
     Returns:
         a dataframe in which the duplicates differences in the given columns have been resolved 
         and/or communicated to the user
+
+    Notes:
+        Each pass forward-fills the given columns within every duplicate group with the
+        group sorted on column in the passes order. Rather than re-sorting the frame for
+        every pass, the frame is sorted once in the final passes order and earlier passes
+        with the opposite order are performed as a backward fill within each group.
+        Rows without a value in column belong to no group and are never filled.
     '''    
     if recurs < 1:
         return df
     
     # replace all dashes with NaN
-    df = df.replace('-', np.nan)
+    with stage('duplicate_column_checker', 'replace dashes', df) as record:
+        df = df.replace('-', np.nan)
+        record['rows_out'] = len(df)
     
     # Identify which samples are duplicates and fill in a new column with the original samples name. This way all duplicates have the orginal sample name in its row.
+    with stage('duplicate_column_checker', 'root names', df) as record:
+        df['same'] = root_sample_names(df[column], dup_ends) if same is None else same.set_axis(df.index)
+        record['rows_out'] = len(df)
+
+    # the order of each pass, the recursive implementation always reversed to ascending after the first pass
+    pass_orders = [order] + [True] * (recurs - 1)
+
+    # sort columns first on same then column in the order of the final pass
+    with stage('duplicate_column_checker', 'sort', df) as record:
+        df = df.sort_values(by=['same', column], ascending=[False, pass_orders[-1]], 
+                            kind='mergesort').reset_index(drop=True)
+        record['rows_out'] = len(df)
+
+    # fill the fields in column names within each duplicate group, a pass with the opposite order is a backward fill
+    with stage('duplicate_column_checker', 'fill', df) as record:
+        named = df['same'].notna()
+        for pass_order in pass_orders:
+            grouped = df.groupby('same', sort=False)[columns_names]
+            if pass_order == pass_orders[-1]:
+                filled = grouped.ffill()
+            else:
+                filled = grouped.bfill()
+            # rows without a sample name are not duplicates of each other, so they keep their own values
+            df[columns_names] = filled.where(named, df[columns_names], axis=0)
+        record['rows_out'] = len(df)
+
+    return df
+
+
+def root_sample_names(samples, dup_ends=['_2','_3', '_pool7A', '_pool10A']):
+    ''' Derive the original sample name for each sample in the given series
+        by stripping a duplicate ending from it, the last matching one in dup_ends.
+
+    Args:
+        samples: series of sample names
+        dup_end: characters which seperate the original and duplicate sample
+
+    Returns:
+        series of the root sample names, samples without a duplicate ending
+        are returned unchanged
+    '''
+    same = pd.Series(np.nan, index=samples.index, dtype=object)
     for dup in dup_ends:
-        cond = ((df[column].str.endswith(dup)) & (df[column].str.len() > 4))
-        df.ix[cond, 'same'] = df.ix[cond, column].str[:-(len(dup))]
+        cond = ((samples.str.endswith(dup)) & (samples.str.len() > 4)).fillna(False).astype(bool)
+        same[cond] = samples[cond].str[:-(len(dup))]
 
-    # replace NaN in same by entries in column
-    df.same = df.same.combine_first(df[column])
+    # replace NaN in same by entries in samples
+    return same.combine_first(samples)
 
-    # sort columns first on same then column. column is reversed upon the funcs recursion
-    df = df.sort_values(by=['same', column], ascending=[False, order]).reset_index()
-    
-    # get the clumn indexes for the given column names
-    col_ix = [df.columns.get_loc(x) for x in columns_names]
-        
-    # assess whether the sample names in a row and the following row are duplicates and, if so, forward fill the fields described in column names
-    for num in range(0, df.shape[0]-1):
-        
-        current_sam = df['same'].shift(-(num))[0]
-        next_sam = df['same'].shift(-(num+1))[0]
 
-        if current_sam == next_sam:
-            
-            df.iloc[num:num+2, col_ix] = df.iloc[num:num+2, col_ix].ffill(limit=1)
-    
-    #remove column index
-    df.drop(['index'], axis=1, inplace=True)
-    
-    # do the same but reverse the order of secondary order
-    return duplicate_column_checker(df, columns_names, order=True, recurs=recurs-1, dup_ends=dup_ends)
- 
-    
-    
+def sharded_duplicate_column_checker(df, columns_names, order=False, recurs=2, dup_ends=['_2','_3', '_pool7A', '_pool10A'],
+                                     column="Sample", workers=None, partition_size=10**5):
+    ''' Run duplicate_column_checker across a process pool by hash partitioning the
+        rows on their root sample name, as duplicate groups are independent of each other.
+
+    Args:
+        workers: number of processes, None for the number of CPUs
+        partition_size: the target number of rows in each partition
+
+        see duplicate_column_checker for all other arguments
+
+    Returns:
+        the same df as duplicate_column_checker
+
+    Notes:
+        inputs no bigger than partition_size are resolved serially
+    '''
+    if recurs < 1 or len(df) <= partition_size:
+        return duplicate_column_checker(df, columns_names, order, recurs, dup_ends, column)
+
+    workers = workers or os.cpu_count()
+    partitions = max(workers, int(math.ceil(len(df) / partition_size)))
+    same = root_sample_names(df[column], dup_ends)
+    shard = shard_numbers(same, partitions)
+
+    # a stable sort on the shard splits the rows in one pass and keeps their relative
+    # order within each partition, so ties sort the same as the serial run
+    rows = np.argsort(shard, kind='mergesort')
+    bounds = np.flatnonzero(np.diff(shard[rows])) + 1
+    tasks = [(df.iloc[part], columns_names, order, recurs, dup_ends, column, same.iloc[part])
+             for part in np.split(rows, bounds)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        resolved = pd.concat(pool.map(_check_partition, tasks))
+
+    # groups are never split between partitions, so a stable sort gives the serial run's order
+    ascending = order if recurs == 1 else True
+    return resolved.sort_values(by=['same', column], ascending=[False, ascending],
+                                kind='mergesort').reset_index(drop=True)
+
+
+def _check_partition(task):
+    # unpack the arguments of duplicate_column_checker in a worker process
+    return duplicate_column_checker(*task)
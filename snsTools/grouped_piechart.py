@@ -1,5 +1,15 @@
-from scipy import stats
-import plot_manipulations as pm
+import argparse
+import os
+import warnings
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from . import plot_manipulations as pm # sets the headless Agg backend before pyplot is imported
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+import pandas as pd
+from .association_tests import association_test
+from . import render_cache
 
 def grouped_piechart(df, group, qual, font_size=13, title="",
                    colors=['salmon', 'turquoise',  'silver', 'white'], 
@@ -18,7 +28,7 @@ def grouped_piechart(df, group, qual, font_size=13, title="",
         outfile: image output file name
     
     Returns:
-        matplotlib piechart
+        matplotlib axes of the piechart
     '''
     # drop rows without values in group and fill in missing data in qual
     df = df.dropna(subset = [group])
@@ -29,47 +39,52 @@ def grouped_piechart(df, group, qual, font_size=13, title="",
     plt.tick_params(axis='both', which='major', labelsize=13.5) # xtick label sizes
     plt.title(title, fontsize=font_size*2) 
     mpl.rcParams['font.size'] = font_size
-    divisions = df[qual].unique()
-    
-    # get the percentages of the qual counts in each group, remove if qual not present in group, and plot them as piecharts
-    group1 = df[df[group] == df[group].unique()[0]]
-    group1_percent = [len(group1[group1[qual] == x]) / len(group1) for x in divisions]
-    group1_percent, names = remove_zeros(group1_percent, divisions)
-    ax.pie(group1_percent, labels=names,
-            colors=colors, shadow=False, autopct='%1.1f%%', 
-            center=(0,0), startangle=90) 
+
+    # one table of qual counts per group feeds the percentages, n counts and statistical test
+    table = piechart_table(df, group, qual)
+    percentages = table.div(table.sum(axis=1), axis=0)
     
-    group2 = df[df[group] == df[group].unique()[1]]
-    group2_percent = [len(group2[group2[qual] == x]) / len(group2) for x in divisions]
-    group2_percent, names = remove_zeros(group2_percent, divisions)
-    ax.pie(group2_percent, labels=names,
-           colors=colors, shadow=False, autopct='%1.1f%%', 
-           center=(2.5,0), startangle=90)
+    # plot the percentages of the qual counts in each group as piecharts, removing quals not present in a group
+    for center, (name, counts) in zip([(0,0), (2.5,0)], table.iterrows()):
+        present = counts > 0
+        ax.pie(percentages.loc[name, present], labels=table.columns[present],
+               colors=colors, shadow=False, autopct='%1.1f%%', 
+               center=center, startangle=90) 
         
     # set the x ticks and labels 
     ax.axis('equal')
     ax.set_xticks([0, 2.5])
-    xticklabels = ["{}:\nn = {}".format(x,len(df[df[group] == x ])) for x in df[group].unique()]
+    xticklabels = ["{}:\nn = {}".format(x, n) for x, n in table.sum(axis=1).items()]
     ax.set_xticklabels(xticklabels)
     ax.tick_params(labelsize=font_size)
     
-    # create a table for statistical testing and generate pvalue between the two groups
-    table = df.groupby([group, qual]).size().unstack(1).fillna(0.0)
-    array = table.values.tolist()
-    if len(divisions) == 2:
-        oddsratio, pvalue = stats.fisher_exact(array)
-    else:
-        chi2, pvalue, dof, expected = stats.chi2_contingency(array)
-        
-    pm.lines_between_plots(df, 0,2.5,1.5, 0.1, "l", "p = "+str(round(pvalue,3)))
+    # generate pvalue between the two groups
+    pvalue = association_test(table)
+    pm.line_between_plots(ax, 0, 2.5, 1.5, "p = "+str(round(pvalue,3)), extend=0.1)
 
     # decide whether to save or not
     if outfile:
         ax.figure.savefig(outfile)
-        pass
-    
 
+    return ax
     
+
+def piechart_table(df, group, qual):
+    ''' Count the occurrences of each value of qual within each value of group.
+
+    Args:
+        df: Pandas DataFrame
+        group: a column in df containing categorical data
+        qual: a column in df containing categorical data
+
+    Returns:
+        DataFrame of counts with a row per group and a column per qual, both
+        in the order in which they first appear in df
+    '''
+    table = pd.crosstab(df[group], df[qual])
+    return table.reindex(index=df[group].unique(), columns=df[qual].unique(), fill_value=0)
+
+
 def remove_zeros(percent, strings):
     ''' Identify any zeros in percent, get their
         indexes and remove the values in percent 
@@ -78,14 +93,108 @@ def remove_zeros(percent, strings):
     Args:
         percent: list of integers
         strings: list of strings
+
+    Notes:
+        deprecated, grouped_piechart now leaves out the empty wedges of its
+        count table itself. It will be removed in a later release.
     '''
-    if 0 in percent:
+    warnings.warn("remove_zeros is deprecated and will be removed in a later release",
+                  DeprecationWarning, stacklevel=2)
+    while 0 in percent:
         index = [x[0] for x in enumerate(percent) if x[1] == 0][0]
         strings = list(strings[:index]) + list(strings[index+1 :])
         percent = percent[:index] + percent[index+1:]
-        return remove_zeros(percent, strings)
 
-    else:
-        return (percent, strings)
+    return (percent, strings)
+
+
+def render_piechart(df, group, qual, outfile, **kwargs):
+    ''' Save a grouped_piechart to a file and close it, restoring the file from the
+        active render cache instead of drawing it when it has been rendered before.
+
+    Args:
+        outfile: image output file name
+        kwargs: other arguments given to grouped_piechart
+
+        see grouped_piechart for all other arguments
+
+    Returns:
+        outfile
+    '''
+    hit, key = render_cache.lookup('grouped_piechart', outfile, (group, qual, sorted(kwargs.items())),
+                                   df=df[[group, qual]])
+    if not hit:
+        ax = grouped_piechart(df, group, qual, outfile=outfile, **kwargs)
+        plt.close(ax.figure)
+        render_cache.store(key, outfile)
+    return outfile
+
+
+def render_pair(task):
+    ''' Render the piechart for a single (group, qual) pair and close it.
+
+    Args:
+        task: tuple of the DataFrame slice, group, qual, outfile and 
+              a dictionary of other grouped_piechart arguments
+    '''
+    df, group, qual, outfile, kwargs = task
+    return render_piechart(df, group, qual, outfile, **kwargs)
+
+
+def render_csv(f, groups, quals, outdir, workers=None, sep=',', **kwargs):
+    ''' Render a piechart PNG for every (group, qual) pair in a csv.
+
+    Args:
+        f: csv file
+        groups: list of group columns
+        quals: list of qual columns
+        outdir: directory to write the PNGs to, named <group>_<qual>.png
+        workers: number of processes, by default the number of CPUs
+        sep: delimiter used in the csv
+        kwargs: other arguments given to grouped_piechart
+
+    Returns:
+        list of the PNGs written
+
+    Notes:
+        the csv is read once and each worker is only sent the two columns it plots.
+        The workers use the active render cache, if any, see render_cache
+    '''
+    df = pd.read_csv(f, sep=sep, usecols=list(set(groups) | set(quals)))
+    tasks = [(df[[group, qual]], group, qual, 
+              os.path.join(outdir, "{}_{}.png".format(group, qual)), kwargs)
+             for group in groups for qual in quals if group != qual]
+
+    cache = render_cache.settings()
+    outfiles = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=render_cache.enable if cache else None,
+                             initargs=cache) as pool:
+        for outfile, counts in pool.map(render_cache.counted, repeat(render_pair), tasks):
+            render_cache.add_counts(counts)
+            outfiles.append(outfile)
+    return outfiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render grouped piecharts from a csv into PNG files")
+    parser.add_argument('csv', help='csv containing the group and qual columns')
+    parser.add_argument('--group', nargs='+', required=True, help='columns to split the data into two groups by')
+    parser.add_argument('--qual', nargs='+', required=True, help='columns to plot in each piechart')
+    parser.add_argument('--outdir', default='.', help='directory to write the PNGs to')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes')
+    parser.add_argument('--sep', default=',', help='delimiter used in the csv')
+    parser.add_argument('--font-size', type=float, default=13, help='fontsize for labels')
+    parser.add_argument('--cache', help='directory to cache rendered piecharts in')
+    parser.add_argument('--cache-mb', type=float, default=512, help='size of the cache in MB')
+    args = parser.parse_args()
+
+    cache = render_cache.cache_renders(args.cache, args.cache_mb) if args.cache else nullcontext()
+    with cache:
+        outfiles = render_csv(args.csv, args.group, args.qual, args.outdir, args.workers, 
+                              args.sep, font_size=args.font_size)
+    for outfile in outfiles:
+        print(outfile)
 
 
+if __name__ == '__main__':
+    main()
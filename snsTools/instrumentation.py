@@ -0,0 +1,95 @@
+''' Opt-in recording of the wall time, rows in and out and peak memory of
+    each stage of the multi-stage tools
+
+Example:
+    with record_stages(memory=True) as records:
+        df = duplicate_resolver(df, "Sample", ["Sex", "Status"])
+    pd.DataFrame(records)
+'''
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+_recorders = []
+
+
+@contextmanager
+def record_stages(callback=None, memory=False):
+    ''' Record every stage run by the tools within the with block.
+
+    Args:
+        callback: function called with each record as soon as its stage ends
+        memory: trace the peak memory of each stage above the memory in use when it 
+                began, this slows the stages down
+
+    Yields:
+        list to which a dictionary is appended for every stage with the keys
+        tool, stage, seconds, rows_in, rows_out and peak_mb
+    '''
+    records = []
+    recorder = {'records': records, 'callback': callback, 'memory': memory}
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _recorders.append(recorder)
+    try:
+        yield records
+    finally:
+        _recorders.remove(recorder)
+        if started:
+            tracemalloc.stop()
+
+
+@contextmanager
+def stage(tool, name, df=None):
+    ''' Time a stage of a tool, doing nothing unless record_stages is active.
+
+    Args:
+        tool: name of the tool
+        name: name of the stage
+        df: the DataFrame going into the stage
+
+    Yields:
+        the record of the stage, set its rows_out key to the number of rows
+        coming out of the stage
+
+    Notes:
+        stages should not be nested as each resets the traced memory peak
+    '''
+    if not _recorders:
+        yield {}
+        return
+
+    record = {'tool': tool, 'stage': name, 'seconds': None, 'rows_in': None if df is None else len(df),
+              'rows_out': None, 'peak_mb': None}
+    memory = tracemalloc.is_tracing() and any(recorder['memory'] for recorder in _recorders)
+    if memory:
+        tracemalloc.reset_peak()
+        in_use = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        if memory:
+            record['peak_mb'] = (tracemalloc.get_traced_memory()[1] - in_use) / 2**20
+        for recorder in _recorders:
+            recorder['records'].append(record)
+            if recorder['callback']:
+                recorder['callback'](record)
+
+
+def summarise_values(values, limit=20):
+    ''' Join values into a string of at most limit values followed by the number left out.
+
+    Args:
+        values: list of values
+        limit: maximum number of values to include, None for all of them
+
+    Returns:
+        string of the values
+    '''
+    values = [str(value) for value in values]
+    if limit is None or len(values) <= limit:
+        return " ".join(values)
+    return "{} ... and {} more".format(" ".join(values[:limit]), len(values) - limit)
@@ -1,6 +1,12 @@
+import re
+from collections import namedtuple
+import numpy as np
 import pandas as pd
+from .data_manipulations import is_parquet
+from .instrumentation import stage
 
-def next_most_damaging(old_most_dam, all_vars, AB=0.3, Gene="SKI", Exon="1/7"):
+def next_most_damaging(old_most_dam, all_vars, AB=0.3, Gene="SKI", Exon="1/7", score=None, top_k=1,
+                       false_positives=None, ascending=False):
     ''' Replace the most damaging variant for each patients variant whom
         does not pass the allele balance threshold or whoms variant is
         within a known false positive gene and exon. If the existing most 
@@ -13,28 +19,294 @@ def next_most_damaging(old_most_dam, all_vars, AB=0.3, Gene="SKI", Exon="1/7"):
         AB: allele balance minimum threshold
         Gene: gene in which a known false positive lies within 
         Exon: exon of said gene in which a known false positive lies within
+        score: column in all_vars to rank variants by, the highest scoring variant is the
+               most damaging, or a list of columns where later columns break ties in earlier
+               ones. If None then all_vars is assumed to be sorted by score already
+        top_k: number of alternative variants to put in place of each replaced variant
+        false_positives: compiled false positive rules (see load_false_positives) checked
+                         in addition to Gene and Exon
+        ascending: rank the lowest score as the most damaging instead, or a list with an
+                   entry per score column
 
     Returns:
         The old_most_dam df where the next most damaging variant has been 
         put in place of the old most damaging variant that did not pass 
         the allele balance threshold or was within a known false positive
+    
+    Notes:
+        if top_k is greater than one then each replaced sample has up to top_k rows,
+        ordered from the most to the least damaging
     '''
-    # drop duplicates (dropping is fine as they have been sorted by score)
-    all_alt_vars = get_other_variants(old_most_dam, all_vars, AB, Gene, Exon)
-    alt_most_dam = all_alt_vars.drop_duplicates(['Sample'])
-    alt_most_dam['new_md'] = "Y"   # mark sample/variants 
+    alt_most_dam = top_other_variants(old_most_dam, all_vars, AB, Gene, Exon, score, top_k,
+                                      false_positives, ascending)
 
+    with stage('next_most_damaging', 'replace', old_most_dam) as record:
+        new_most_dam = replace_most_damaging(old_most_dam, alt_most_dam, top_k)
+        record['rows_out'] = len(new_most_dam)
 
-    # append the newly selected most damaging, sort so these variants appear above old most damaging vars and drop duplicates so only new most damaging remain.
-    append_most_dam = old_most_dam.append(alt_most_dam)
-    append_most_dam = append_most_dam.sort_values(by=['Sample', 'new_md'])
-    
-    new_most_dam = append_most_dam.drop_duplicates('Sample')[old_most_dam.columns]
+    return new_most_dam
+
+
+def next_most_damaging_from_file(old_most_dam, all_vars_file, AB=0.3, Gene="SKI", Exon="1/7", score=None, 
+                                 top_k=1, false_positives=None, chunksize=10**6, sep=',', ascending=False):
+    ''' Out-of-core version of next_most_damaging which streams the variants from a 
+        delimited file in chunks, rather than holding all of the variants in memory.
+
+    Args:
+        old_most_dam: existing dataframe which details the most damaging variant for each patient
+        all_vars_file: delimited or parquet (.parquet or .pq) file containing all variants
+                       associated with the patients detailed in old_most_dam
+        chunksize: number of variants to read from a delimited all_vars_file at a time
+        sep: delimiter used in a delimited all_vars_file
+        
+        see next_most_damaging for all other arguments
+
+    Returns:
+        The same df as next_most_damaging would return for all_vars_file read into memory
+
+    Notes:
+        only the variants of the flagged samples are kept and only the top_k best of those
+        per sample are carried between chunks, so memory is bounded by the number of samples.
+        Parquet files are read in one go but only the columns of old_most_dam and score are
+        read, and only for the flagged samples. Reading parquet files requires pyarrow.
+        Sample, Symbol and Exon are read from a delimited file as strings so every chunk
+        has the same types, and the file is not read at all if no sample is flagged.
+    '''
+    with stage('next_most_damaging', 'flag samples', old_most_dam) as record:
+        samples = unwanted_samples(old_most_dam, AB, Gene, Exon, false_positives)
+        record['rows_out'] = len(samples)
+    alt_most_dam = None
+
+    if not len(samples):
+        chunks = []
+    elif is_parquet(all_vars_file):
+        # only the needed columns of the flagged samples variants are read
+        with stage('next_most_damaging', 'read parquet') as record:
+            all_vars = read_parquet_variants(all_vars_file, samples, list(old_most_dam.columns) + score_columns(score))
+            record['rows_out'] = len(all_vars)
+        with stage('next_most_damaging', 'drop unwanted', all_vars) as record:
+            all_vars = identify_unwanted(all_vars, AB, Gene, Exon, false_positives)
+            all_vars = all_vars[all_vars['Unwanted'] != "Y"]
+            record['rows_out'] = len(all_vars)
+        alt_most_dam = rank_variants(all_vars, score=score, k=top_k, ascending=ascending)
+        chunks = []
+    else:
+        # types are otherwise inferred per chunk, e.g. a chunk of only numeric sample names
+        chunks = pd.read_csv(all_vars_file, sep=sep, chunksize=chunksize,
+                             dtype={'Sample': str, 'Symbol': str, 'Exon': str})
+        names = pd.Series(pd.unique(samples)).astype(str)
+
+    for chunk in chunks:
+        with stage('next_most_damaging', 'chunk', chunk) as record:
+            chunk = chunk[chunk['Sample'].isin(names)]
+            chunk = identify_unwanted(chunk.copy(), AB, Gene, Exon, false_positives)
+            chunk = chunk[chunk['Unwanted'] != "Y"]
+            # the best variants from previous chunks precede this chunk so ties are broken by file position
+            if alt_most_dam is not None:
+                chunk = pd.concat([alt_most_dam, chunk])
+            alt_most_dam = rank_variants(chunk, score=score, k=top_k, ascending=ascending)
+            record['rows_out'] = len(alt_most_dam)
+
+    if alt_most_dam is None:
+        alt_most_dam = old_most_dam.iloc[:0]
+    elif not is_parquet(all_vars_file):
+        # give the sample names read as strings the type of those they replace
+        lookup = dict(zip(names, pd.unique(samples)))
+        alt_most_dam = alt_most_dam.assign(Sample=alt_most_dam['Sample'].map(lookup))
+
+    with stage('next_most_damaging', 'replace', old_most_dam) as record:
+        new_most_dam = replace_most_damaging(old_most_dam, alt_most_dam, top_k)
+        record['rows_out'] = len(new_most_dam)
+
+    return new_most_dam
+
+
+def read_parquet_variants(f, samples, columns=[]):
+    ''' Read the variants of the given samples from a parquet file, pushing
+        the sample filter and column selection down to the reader.
+
+    Args:
+        f: parquet file of variants
+        samples: sample names to read the variants of
+        columns: columns to read in addition to Sample, Symbol, Exon and AB,
+                 those not in the file are ignored
+
+    Returns:
+        DataFrame of variants
+    '''
+    import pyarrow.parquet as pq
+
+    schema = pq.read_schema(f)
+    wanted = ['Sample', 'Symbol', 'Exon', 'AB'] + [col for col in columns if col is not None]
+    columns = [col for col in schema.names if col in wanted]
+
+    samples = list(pd.unique(samples))
+    if not samples:
+        return schema.empty_table().to_pandas()[columns]
+    return pd.read_parquet(f, columns=columns, filters=[('Sample', 'in', samples)])
+
+
+def replace_most_damaging(old_most_dam, alt_most_dam, top_k=1):
+    ''' Put the alternative most damaging variants in place of the old most damaging 
+        variants of the same samples.
+
+    Args:
+        old_most_dam: existing dataframe which details the most damaging variant for each patient
+        alt_most_dam: the selected alternative variants for the samples that need replacing
+        top_k: number of alternative variants selected per sample
+
+    Returns:
+        old_most_dam with the alternatives in place, sorted by sample
+    '''
+    # keep the old most damaging for samples without an alternative and put the alternatives in place of the rest
+    keep_old = old_most_dam[~old_most_dam['Sample'].isin(alt_most_dam['Sample'])]
+    alt_most_dam = alt_most_dam.reindex(columns=old_most_dam.columns)
+
+    # categorical columns only stay categorical when concatenated if both sides share their categories
+    for col in old_most_dam.columns:
+        if keep_old[col].dtype.name == 'category':
+            categories = keep_old[col].cat.categories
+            values = alt_most_dam[col].dropna().astype(object)
+            categories = categories.append(pd.Index(values.unique()).difference(categories))
+            keep_old = keep_old.assign(**{col: keep_old[col].cat.set_categories(categories)})
+            alt_most_dam[col] = pd.Categorical(alt_most_dam[col].astype(object), dtype=keep_old[col].dtype)
+    new_most_dam = pd.concat([alt_most_dam, keep_old]).sort_values(by='Sample', kind='mergesort')
+
+    if top_k == 1:
+        new_most_dam = new_most_dam.drop_duplicates('Sample')
     
     return new_most_dam
 
 
-def get_other_variants(most_damaging, all_var, AB, Gene, Exon):
+def rank_variants(df, score=None, k=1, column='Sample', ascending=False):
+    ''' Select the k highest scoring variants for each sample without sorting them.
+
+    Args:
+        df: DataFrame of variants
+        score: column to rank variants by or a list of columns where later columns break 
+               ties in earlier ones, if None the first rows of each sample are selected
+        k: number of variants to select per sample
+        column: column containing the sample names
+        ascending: select the lowest scores instead, or a list with an entry per score column
+
+    Returns:
+        the selected rows of df, ordered by their position in df when score is None
+        otherwise by sample and then from the highest to lowest score
+
+    Notes:
+        ties in score and missing scores are ranked by their position in df. The best
+        remaining variant of every sample is found in each of k passes over the scores, 
+        so only the selected rows are ever sorted
+    '''
+    if k < 1:
+        raise ValueError("rank_variants: k must be positive.")
+
+    if score is None:
+        return df.groupby(df[column], sort=False, observed=True).head(k)
+
+    scores = score_columns(score)
+    if isinstance(ascending, bool):
+        ascending = [ascending] * len(scores)
+    # flip ascending scores so the best is always the highest and missing scores are the least damaging
+    keys = [np.where(asc, -1, 1) * df[col].astype(float).fillna(np.inf if asc else -np.inf).values
+            for col, asc in zip(scores, ascending)]
+    codes, uniques = pd.factorize(df[column], sort=True)
+
+    remaining = codes >= 0
+    passes = []
+    for rank in range(k):
+        positions = best_positions(keys, codes, remaining, len(uniques))
+        if not len(positions):
+            break
+        remaining[positions] = False
+        passes.append((codes[positions], np.full(len(positions), rank), positions))
+
+    if not passes:
+        return df.iloc[[]]
+    codes, ranks, positions = [np.concatenate(arrays) for arrays in zip(*passes)]
+    return df.iloc[positions[np.lexsort((ranks, codes))]]
+
+
+def best_positions(keys, codes, candidates, n_groups):
+    ''' Find the position of the best candidate row of each group.
+
+    Args:
+        keys: list of score arrays, higher is better and later keys break ties in earlier ones
+        codes: integer group of each row
+        candidates: boolean array of the rows which can be chosen
+        n_groups: number of groups
+
+    Returns:
+        array of positions, at most one per group and ties broken by the first position
+    '''
+    candidates = candidates.copy()
+    for key in keys:
+        # the extra slot is looked up by rows without a group, code -1, which are never candidates
+        best = np.full(n_groups + 1, -np.inf)
+        np.maximum.at(best, codes[candidates], key[candidates])
+        candidates &= key == best[codes]
+
+    positions = np.flatnonzero(candidates)
+    first = np.unique(codes[positions], return_index=True)[1]
+    return positions[first]
+
+
+def score_columns(score):
+    ''' Get the list of score columns from a single column, a list of columns or None.
+    '''
+    if score is None:
+        return []
+    if isinstance(score, str):
+        return [score]
+    return list(score)
+
+
+def top_other_variants(most_damaging, all_var, AB, Gene, Exon, score=None, k=1, false_positives=None,
+                       ascending=False):
+    ''' Get the k next most damaging variants of every sample whose most damaging
+        variant is unwanted, the same as ranking the output of get_other_variants.
+
+    Args:
+        most_damaging: csv containg most damaging variants per sample
+        all_var: all called variants assocaited with each sample referred to in most_damaging patients
+        score: see rank_variants
+        k: number of variants to select per sample
+        ascending: see rank_variants
+
+        see get_other_variants for all other arguments
+
+    Returns:
+        the selected rows of all_var, see rank_variants for their order
+
+    Notes:
+        only the columns needed to filter and rank the variants of the flagged samples 
+        are copied, the rest of all_var is only read for the selected rows
+    '''
+    with stage('next_most_damaging', 'flag samples', most_damaging) as record:
+        samples = unwanted_samples(most_damaging, AB, Gene, Exon, false_positives)
+        record['rows_out'] = len(samples)
+
+    with stage('next_most_damaging', 'filter samples', all_var) as record:
+        positions = np.flatnonzero(all_var['Sample'].isin(samples).values)
+        needed = ['Sample', 'Symbol', 'Exon', 'AB'] + score_columns(score)
+        columns = [col for col in all_var.columns if col in needed]
+        # label the candidates by their position so the selection can be read from all_var
+        candidates = all_var[columns].iloc[positions].set_axis(positions)
+        record['rows_out'] = len(candidates)
+
+    with stage('next_most_damaging', 'drop unwanted', candidates) as record:
+        candidates = identify_unwanted(candidates, AB, Gene, Exon, false_positives)
+        candidates = candidates[candidates['Unwanted'] != "Y"]
+        record['rows_out'] = len(candidates)
+
+    with stage('next_most_damaging', 'rank', candidates) as record:
+        selected = rank_variants(candidates, score=score, k=k, ascending=ascending)
+        record['rows_out'] = len(selected)
+
+    return all_var.iloc[selected.index.values]
+
+
+def get_other_variants(most_damaging, all_var, AB, Gene, Exon, false_positives=None):
     ''' Get a list of all sample names that contain a given false positive variant 
         or a variant which does not pass the threshold of the allele balance and 
         use it to get all other variants asociated with said sample.
@@ -42,6 +314,7 @@ def get_other_variants(most_damaging, all_var, AB, Gene, Exon):
     Args:   
         most_damaging: csv containg most damaging variants per sample
         all_var: all called variants assocaited with each sample referred to in most_damaging patients
+        false_positives: compiled false positive rules (see compile_false_positives)
 
     Returns:
         A modified all_vars df which has all the alternative variants for each
@@ -50,44 +323,61 @@ def get_other_variants(most_damaging, all_var, AB, Gene, Exon):
         score.
         
     '''
-    # copy and rename columns
-    df = most_damaging.copy()
-    df = df.fillna("-")
+    with stage('next_most_damaging', 'flag samples', most_damaging) as record:
+        samples = unwanted_samples(most_damaging, AB, Gene, Exon, false_positives)
+        record['rows_out'] = len(samples)
+                                               
+    # filter for only rows that contain sample name in the unwanted samples
+    with stage('next_most_damaging', 'filter samples', all_var) as record:
+        all_vars = all_var[all_var['Sample'].isin(samples)].copy()
+        record['rows_out'] = len(all_vars)
+    
+    # filter for variants with AB > 0.3 or aren't SKI exon 1
+    with stage('next_most_damaging', 'drop unwanted', all_vars) as record:
+        all_vars = identify_unwanted(all_vars, AB, Gene, Exon, false_positives)
+        all_vars = all_vars[all_vars['Unwanted'] != "Y"]
+        record['rows_out'] = len(all_vars)
+
+    return all_vars 
+ 
+
+
+def unwanted_samples(most_damaging, AB, Gene, Exon, false_positives=None):
+    ''' Get the names of the samples whose most damaging variant does not pass the 
+        allele balance threshold or is within a known false positive.
 
+    Args:
+        most_damaging: csv containg most damaging variants per sample
+
+        see get_other_variants for all other arguments
+
+    Returns:
+        series of sample names
+    '''
     # remove samples that have all NaN entries in the fields of interest
-    df['all_nan'] = df.apply(lambda x: "Y" if (x['Symbol'] == "-" and x['Exon'] == "-" 
-                             and x['AB'] == "-") else "N", axis=1)
-    df = df[~df['all_nan'].str.contains("Y")]
+    fields = most_damaging[['Symbol', 'Exon', 'AB']]
+    all_nan = (fields.isna() | (fields == "-")).all(axis=1)
+    df = most_damaging[~all_nan].copy()
 
     # convert AB to numeric
     df['AB'] = pd.to_numeric(df['AB'], errors='coerce')
 
     # filter for variants with SKI exon1 and AB < 0.3
-    df = identify_unwanted(df, AB, Gene, Exon)   
-    df = df[df['Unwanted'].str.contains("Y", na=False)]
-                                               
-    # list of all sample names 
-    l = df['Sample'].tolist()
-    
-    # copy and rename columns
-    all_vars = all_var.copy()
-    
-    # filter for only rows that contain sample name in the given list
-    all_vars['cross'] = all_vars['Sample'].isin(l)
-    all_vars = all_vars[all_vars['cross'] == True]
-    
-    # filter for variants with AB > 0.3 or aren't SKI exon 1
-    all_vars = identify_unwanted(all_vars, AB, Gene, Exon)
-    all_vars = all_vars[~all_vars['Unwanted'].str.contains("Y", na=False)]
-
-    return all_vars 
- 
+    df = identify_unwanted(df, AB, Gene, Exon, false_positives)   
+    return df.loc[df['Unwanted'] == "Y", 'Sample']
 
 
-def identify_unwanted(df, AB, Gene=None, Exon=None):
+def identify_unwanted(df, AB, Gene=None, Exon=None, false_positives=None):
     ''' Identify and mark rows with variants which have a allele 
         balance less than the given threshold or a variant within 
         a known false positive
+
+    Args:
+        df: DataFrame of variants
+        AB: allele balance minimum threshold
+        Gene: gene in which a known false positive lies within 
+        Exon: exon of said gene in which a known false positive lies within
+        false_positives: compiled false positive rules (see compile_false_positives)
     '''
     mask = (df.AB < AB)
     
@@ -95,9 +385,86 @@ def identify_unwanted(df, AB, Gene=None, Exon=None):
         mask = (mask | ((df.Symbol.str.contains(Gene)) & (df.Exon.str.contains(Exon))))
     elif Gene:
         mask = (mask | (df.Symbol.str.contains(Gene)))
-        
-    df.ix[mask, 'Unwanted'] = "Y"
+
+    if false_positives is not None:
+        mask = (mask | false_positive_mask(df, false_positives))
+
+    if 'Unwanted' not in df.columns:
+        df['Unwanted'] = pd.Series(np.nan, index=df.index, dtype=object)
+    df.loc[mask.fillna(False).astype(bool), 'Unwanted'] = "Y"
     
     return df
 
 
+FalsePositives = namedtuple('FalsePositives', ['pairs', 'genes', 'regex'])
+
+
+def load_false_positives(f, sep=','):
+    ''' Load a file of known false positives and compile it into a rule set.
+
+    Args:
+        f: file with the columns Symbol and Exon and, optionally, Regex
+        sep: delimiter used in the file
+
+    Returns:
+        FalsePositives rule set
+
+    Notes:
+        A row without an Exon marks the whole gene as a false positive. Rows
+        with Y in the Regex column are treated as regular expressions which
+        are searched for in Symbol and Exon, all other rows must match exactly.
+    '''
+    rules = pd.read_csv(f, sep=sep, dtype=str)
+    return compile_false_positives(rules)
+
+
+def compile_false_positives(rules):
+    ''' Compile false positive rules into hashed (Symbol, Exon) and Symbol
+        lookups with the regular expression rules kept separate.
+
+    Args:
+        rules: DataFrame with the columns Symbol, Exon and optionally Regex, 
+               or a list of (Symbol, Exon) tuples where Exon can be None
+
+    Returns:
+        FalsePositives rule set
+    '''
+    if not isinstance(rules, pd.DataFrame):
+        rules = pd.DataFrame(list(rules), columns=['Symbol', 'Exon'])
+    if 'Regex' not in rules.columns:
+        rules = rules.assign(Regex="N")
+
+    rules = rules.replace('-', np.nan)
+    is_regex = rules['Regex'].astype(str).str.upper().isin(['Y', 'TRUE'])
+    exact, regex = rules[~is_regex], rules[is_regex]
+
+    whole_gene = exact['Exon'].isna()
+    pairs = pd.MultiIndex.from_frame(exact.loc[~whole_gene, ['Symbol', 'Exon']])
+    genes = pd.Index(exact.loc[whole_gene, 'Symbol'].unique())
+    regex = [(re.compile(gene), re.compile(exon) if isinstance(exon, str) else None) 
+             for gene, exon in zip(regex['Symbol'], regex['Exon'])]
+
+    return FalsePositives(pairs=pairs, genes=genes, regex=regex)
+
+
+def false_positive_mask(df, false_positives):
+    ''' Identify variants within the given compiled false positives.
+
+    Args:
+        df: DataFrame of variants with Symbol and Exon columns
+        false_positives: FalsePositives rule set
+
+    Returns:
+        boolean series which is True for variants within a false positive
+    '''
+    variants = pd.MultiIndex.from_arrays([df['Symbol'], df['Exon']])
+    mask = pd.Series(variants.isin(false_positives.pairs), index=df.index)
+    mask |= df['Symbol'].isin(false_positives.genes)
+
+    for gene, exon in false_positives.regex:
+        in_gene = df['Symbol'].str.contains(gene, na=False)
+        if exon is not None:
+            in_gene &= df['Exon'].str.contains(exon, na=False)
+        mask |= in_gene
+
+    return mask
@@ -1,11 +1,20 @@
 ''' Alter or add elements of/to a seaborn plot
 '''
 import matplotlib as mpl; mpl.use('Agg') 
-from matplotlib.lines import Line2D
+from matplotlib.collections import LineCollection
 import numpy as np
 import PIL
 from PIL import ImageDraw, ImageFont, Image
 import logging
+import math
+import os
+import string
+import struct
+import zlib
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from . import render_cache
 
 def rename_xtick(df, col, counts=True, name2label={}, order=[]):
     ''' Get the value counts of each unique entry in the given column
@@ -23,7 +32,8 @@ def rename_xtick(df, col, counts=True, name2label={}, order=[]):
         list of xtick labels and their value counts 
     
     Notes:
-        order only works if the parsed column is not already a category
+        order only works if the parsed column is not already a category.
+        The given df is not modified.
     
     Example:
         df = sns.load_dataset("tips")
@@ -31,31 +41,58 @@ def rename_xtick(df, col, counts=True, name2label={}, order=[]):
         ax = sns.violinplot(x="day", y="total_bill", data=df)
         ax.set_xticklabels(n)
     '''
-    if not order:
-        order = df[col].unique()
+    summary = count_summary(df, [col], orders={col: order})
+    logging.warning("Ensure xticks are renamed as expected!")                    
+    return xtick_labels(summary, col, counts=counts, name2label=name2label)
 
-    if df[col].dtypes.name != 'category':
-        convert = df[col].astype('category')
-        df[col] = convert.cat.set_categories(order)
+def count_summary(df, cols, orders={}):
+    ''' Get the value counts of every given column in one go, so the xtick 
+        labels of a batch of plots can be made without recounting.
 
-    # store the value counts of the col entries
-    sizes = df.groupby(col).size().iteritems()
-    if counts:
-        name_count = [(name+"\n"+"n = "+str(n)) for name, n in sizes]
-    else:
-        name_count = [(name+"\n") for name, n in sizes]
-    
-    name_change = []
-    for info in name_count:
-        name = info.split("\n")[0]
-        if name in list(name2label.keys()):
-            new_name = info.replace(name, name2label.get(name))
-            name_change.append(new_name)
+    Args:
+        df: DataFrame
+        cols: columns to count the values of
+        orders: a dictionary where the key is a column and the item is the
+                order of its labels, by default the order of appearance
+
+    Returns:
+        a dictionary where the key is the column and the item is a series
+        of the counts of each label in order
+
+    Notes:
+        categorical columns keep the order of their categories and count
+        unobserved categories as zero, the same as rename_xtick always has
+    '''
+    summary = {}
+    for col in cols:
+        values = df[col]
+        if values.dtype.name == 'category':
+            order = values.cat.categories
+        elif orders.get(col) is not None and len(orders.get(col)):
+            order = orders[col]
         else:
-            name_change.append(info)
-            
-    logging.warning("Ensure xticks are renamed as expected!")                    
-    return name_change
+            order = values.dropna().unique()
+        summary[col] = values.value_counts().reindex(order, fill_value=0)
+    return summary
+
+def xtick_labels(summary, col, counts=True, name2label={}):
+    ''' Make the xtick labels of a column from a count summary.
+
+    Args:
+        summary: counts of each column, see count_summary
+        col: column to make the labels for
+        counts: whether to display the value counts or not
+        name2label: a dictionary where the key is the current x label and
+                    the item is the label to rename it to
+
+    Returns:
+        list of xtick labels and their value counts 
+    '''
+    labels = []
+    for name, n in summary[col].items():
+        label = str(name2label.get(name, name))
+        labels.append(label+"\n"+"n = "+str(n) if counts else label+"\n")
+    return labels
 
 def line_between_plots(axs, x1, x2, height, string, fontsize=12, extend=2):
     ''' Draw a horizontal line and string between two points with 
@@ -66,7 +103,7 @@ def line_between_plots(axs, x1, x2, height, string, fontsize=12, extend=2):
                 |               |
  
     Args:
-        axs: list of axes to draw upon
+        axs: axes or list of axes to draw upon
         x1: start of horizontal line
         x2: end of horizontal line
         height: where on the y-axis the horizonatl line be drwan
@@ -74,55 +111,244 @@ def line_between_plots(axs, x1, x2, height, string, fontsize=12, extend=2):
         fontsize: fontsize of the string
         extend: points to extend the vertical lines by
 
+    Returns:
+        axs
+
     Notes:
         if this drawing is not visible on your axes then you may
         have to manually set the ylim to ensure it is visible.
+        To draw many brackets at once use significance_brackets.
     '''
-    if not isinstance(axs, list):
-        axs = [axs]
+    significance_brackets(axs, [x1], [x2], [height], [string], fontsize=fontsize, extend=extend, stack=False)
+    return axs
+
+def significance_brackets(axs, x1, x2, heights, labels=None, fontsize=12, extend=2, stack=True, 
+                          step=None, color='black'):
+    ''' Draw many brackets, as drawn by line_between_plots, on every axis with all
+        of the lines of an axis in a single LineCollection.
+
+    Args:
+        axs: axes, list or array of axes to draw upon
+        x1: array of the start of each bracket
+        x2: array of the end of each bracket
+        heights: array of the lowest height of each bracket
+        labels: list of the text placed above each bracket, e.g. p values
+        fontsize: fontsize of the labels
+        extend: points to extend the vertical lines down by
+        stack: raise brackets that overlap horizontally so they do not collide
+        step: the height between stacked brackets, by default three times extend
+
+    Returns:
+        array of the height at which each bracket was drawn
+
+    Notes:
+        when stacking, narrower brackets are placed first so they sit beneath the
+        wider brackets spanning them. As with line_between_plots, the ylim may
+        need to be raised for the brackets to be visible.
+    '''
+    axs = [axs] if hasattr(axs, 'add_collection') else list(np.ravel(axs))
+    x1 = np.asarray(x1, dtype=float)
+    x2 = np.asarray(x2, dtype=float)
+    heights = np.array(heights, dtype=float)
+    if stack:
+        heights = stack_brackets(np.minimum(x1, x2), np.maximum(x1, x2), heights, 
+                                 extend * 3 if step is None else step)
+
+    # a horizontal line and two vertical lines per bracket
+    segments = np.stack([np.column_stack([x1, heights, x2, heights]),
+                         np.column_stack([x1, heights - extend, x1, heights]),
+                         np.column_stack([x2, heights - extend, x2, heights])], axis=1).reshape(-1, 2, 2)
 
     for ax in axs:
-        ax.add_line(Line2D(xdata=[x1, x2], ydata=[height, height], color='black'))
-        ax.add_line(Line2D(xdata=[x1, x1], ydata=[height-extend, height], color='black'))
-        ax.add_line(Line2D(xdata=[x2, x2], ydata=[height-extend, height], color='black'))
-        # add string in the middle of horizontal line
-        between_points = (x2+x1)/2
-        ax.text(x=between_points, y=height+(height*0.01), 
-                s=string, fontsize=fontsize,
-                horizontalalignment='center')
-        return ax
-
-def RoundToSigFigs(x, sigfigs):
+        ax.add_collection(LineCollection(segments, colors=color, capstyle='projecting'))
+        if labels is None:
+            continue
+        # matplotlib has no batched text artist so a text is added per label
+        for x, height, label in zip((x1 + x2) / 2, heights, labels):
+            ax.text(x=x, y=height+(height*0.01), s=label, fontsize=fontsize,
+                    horizontalalignment='center')
+
+    return heights
+
+def stack_brackets(starts, ends, heights, step):
+    ''' Raise brackets above any narrower brackets they overlap.
+
+    Args:
+        starts: array of the left end of each bracket
+        ends: array of the right end of each bracket
+        heights: array of the lowest height of each bracket
+        step: the height between stacked brackets
+
+    Returns:
+        array of the new height of each bracket
+    '''
+    stacked = heights.copy()
+    order = np.lexsort((starts, ends - starts))
+    for index, i in enumerate(order):
+        placed = order[:index]
+        # brackets which share an end are treated as overlapping
+        overlap = placed[(starts[placed] <= ends[i]) & (ends[placed] >= starts[i])]
+        if len(overlap):
+            stacked[i] = max(heights[i], stacked[overlap].max() + step)
+    return stacked
+
+def RoundToSigFigs(x, sigfigs, out=None, chunksize=2**16):
     ''' Rounds the value(s) in x to the number of significant figures in sigfigs.
     
     Args:
         x: float
         sigfigs: number of significant figures
+        out: array to store the result in, can be x itself to round in place
+        chunksize: number of values to round at a time
+
+    Returns:
+        the rounded value(s), out if given
 
     Note:
         sigfigs must be an integer type and store a positive value.
         x must be a real value or an array like object containing only real values.
+        Zeros, NaN and inf are returned unchanged. Float arrays keep their dtype,
+        all else is rounded as float64. Only chunk sized temporary arrays are
+        allocated, so large arrays can be rounded without copies of their size.
+        Values are rounded in float64 and then cast to the dtype of out. The
+        significant figures kept are those of '{:.{}g}'.format(value, sigfigs),
+        which rounds the exact value of each float, except that values below
+        10**(sigfigs - 301) may round the wrong way when within a few units in
+        the last place of half way. Results divided by a power of ten above
+        1e22, which is not exact as a float, can be one unit in the last place
+        away from the float nearest to the rounded decimal.
     '''
-    __logBase10of2 = 3.010299956639811952137388947244930267681898814621085413104274611e-1
     if not (type(sigfigs) is int or np.issubdtype(sigfigs, np.integer)):
         raise TypeError("RoundToSigFigs: sigfigs must be an integer.")
 
-    if not np.all(np.isreal(x)):
+    x = np.asarray(x)
+    if np.iscomplexobj(x):
         raise TypeError("RoundToSigFigs: all x must be real.")
 
     if sigfigs <= 0:
         raise ValueError("RoundtoSigFigs: sigfigs must be positive.")
 
-    mantissas, binaryExponents = np.frexp(x)
+    dtype = x.dtype if np.issubdtype(x.dtype, np.floating) else np.dtype(np.float64)
+    if out is None:
+        out = np.empty(x.shape, dtype=dtype)
+    elif out.shape != x.shape or not np.issubdtype(out.dtype, np.floating) or not out.flags.c_contiguous:
+        raise ValueError("RoundToSigFigs: out must be a contiguous float array the same shape as x.")
+
+    values, rounded = x.reshape(-1), out.reshape(-1)
+    # the chunks are worked in float64 whatever the dtype of out and only cast when copied into it
+    size = min(chunksize, values.size)
+    power, scaled, work = np.empty(size), np.empty(size), np.empty(size)
+
+    for start in range(0, values.size, chunksize):
+        v, o = values[start:start+chunksize], rounded[start:start+chunksize]
+        p, r, w = power[:len(v)], scaled[:len(v)], work[:len(v)]
+        special = ~np.isfinite(v) | (v == 0)
+        np.copyto(r, v, casting='unsafe')
+
+        # the power of ten that moves sigfigs digits in front of the decimal point
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            np.abs(r, out=p)
+            np.log10(p, out=p)
+            np.floor(p, out=p)
+            np.subtract(sigfigs - 1, p, out=p)
+
+            # tiny and subnormal values are scaled up first so 10**p does not overflow
+            tiny = np.flatnonzero(~special & (p > 300))
+            extra = 10.0 ** (p[tiny] - 300)
+            r[tiny] *= extra
+            p[tiny] = 300
+
+            # values with a negative power are divided by the exact power of ten rather than
+            # multiplied by its inexact reciprocal, so they are rounded separately
+            negative = np.flatnonzero(p < 0)
+            np.abs(p, out=p)
+            np.power(10.0, p, out=p)
+            shrunk = r[negative] / p[negative]
+            round_exactly(shrunk, r[negative], p[negative], divide=True)
+            shrunk *= p[negative]
+            # the operands of the tiny values are the scaled ones
+            operands = v
+            if len(tiny):
+                operands = v.astype(np.float64)
+                operands[tiny] = r[tiny]
+            np.multiply(r, p, out=r)
+            round_exactly(r, operands, p, work=w)
+            np.divide(r, p, out=r)
+            r[negative] = shrunk
+            r[tiny] /= extra
+
+        np.copyto(o, r, casting='same_kind')
+        special = np.flatnonzero(special)
+        o[special] = v[special]
+
+    return out if out.ndim else out[()]
+
+def round_exactly(t, a, b, divide=False, work=None):
+    ''' Round t in place to the integers nearest to the exact values of a * b, or of
+        a / b, which t holds rounded to floats.
+
+    Args:
+        t: float64 array of a * b or a / b
+        a: array of the first operands
+        b: float64 array of the second operands, each a power of ten
+        divide: t holds a / b rather than a * b
+        work: float64 array the size of t to use as a buffer
+
+    Notes:
+        t can only round the wrong way when it is within a few units in the last
+        place of half way between two integers. The exact value of those few is
+        compared to the half way point with Dekker's exact product and the part of
+        each power of ten lost in its float.
+    '''
+    work = np.empty_like(t) if work is None else work
+    # the distance of each t from the nearest half way point
+    np.trunc(t, out=work)
+    np.subtract(t, work, out=work)
+    np.abs(work, out=work)
+    np.subtract(work, 0.5, out=work)
+    np.abs(work, out=work)
+    near = np.flatnonzero(work <= np.abs(t) * 2.0**-50)
+    near = near[np.abs(t[near]) < 2.0**51]
+    near_t, a, b = t[near], np.asarray(a[near], dtype=np.float64), b[near]
+    np.round(t, out=t)
+    if not len(near):
+        return
+
+    half = np.floor(near_t) + 0.5
+    # the part of each power of ten lost when it was rounded to a float
+    remainder = power_remainders()[np.rint(np.log10(b)).astype(int)]
+    # everything is scaled by a power of two, which is exact, so splitting the largest powers cannot overflow
+    scale = 2.0**-200
+    b, remainder = b * scale, remainder * scale
+    if divide:
+        # a - half * 10**k has the sign of a / 10**k - half
+        product = half * b
+        error = (a * scale - product) - product_error(half, b, product) - half * remainder
+    else:
+        # a * 10**k - half
+        error = product_error(a, b, near_t * scale) + (near_t - half) * scale + a * remainder
+    t[near] = np.where(error > 0, np.ceil(half), np.where(error < 0, np.floor(half), np.round(half)))
 
-    decimalExponents = __logBase10of2 * binaryExponents
-    intParts = np.floor(decimalExponents)
+@lru_cache(maxsize=1)
+def power_remainders():
+    # 10**k minus its float for k up to 308
+    powers = np.power(10.0, np.arange(309.0))
+    return np.array([float(10**k - int(power)) for k, power in enumerate(powers)])
 
-    mantissas *= 10.0**(decimalExponents - intParts)
+def product_error(a, b, product):
+    # the exact value of a * b - product where product is a * b rounded, by Dekker's splitting
+    a_high, a_low = split_float(a)
+    b_high, b_low = split_float(b)
+    return ((a_high * b_high - product) + a_high * b_low + a_low * b_high) + a_low * b_low
 
-    return np.around(mantissas, decimals=sigfigs - 1) * 10.0**intParts
+def split_float(a):
+    # split floats into high and low halves of 26 bits whose products are exact
+    c = 134217729.0 * a
+    high = c - (c - a)
+    return high, a - high
 
-def create_subplot(files, outfile, size=(2000,1600), sub_fig=None, font="Verdana.ttf"):
+def create_subplot(files, outfile, size=(2000,1600), sub_fig=None, font="Verdana.ttf", rows=2, cols=None, 
+                   workers=4, tiled=False):
     ''' Merge multiple images of similar size into one image 
         
     Args:
@@ -131,65 +357,244 @@ def create_subplot(files, outfile, size=(2000,1600), sub_fig=None, font="Verdana
         size: pixel size of the output (width, height)
         sub_fig: add figure number to the corner of each subplot 
         font: font used for sub_fig markings
+        rows: number of rows of subplots
+        cols: number of columns of subplots, by default enough to fit all files in the rows
+        workers: number of threads used to decode and shrink the images
+        tiled: build the image one row of subplots at a time to save memory, see Notes
         
     Returns:
         An image/canvas with all the parsed subplots appended together
         
     Notes:
-        sub_fig only works for upto 4 subplots
+        subplots are placed down each column before moving onto the next column
+
+        in tiled mode each image is opened, placed and released in turn and the
+        rows of subplots are written out as they are completed, so the peak memory
+        is one image and one row of the output. This holds for PNG, PPM and PGM
+        outputs, other formats are assembled into a whole canvas before saving.
         
     '''
+    if cols is None:
+        cols = int(math.ceil(len(files) / rows))
+
+    hit, key = render_cache.lookup('create_subplot', outfile, (size, sub_fig, font, rows, cols), files=files)
+    if hit:
+        return
+
     # Correct the resolution size given based on average dimensions of all imgs in files
-    w, h = correct_size(files, size)
+    w, h = correct_size(files, size, rows, cols)
+
+    # alter the height and width for each plot so they can fit snuggly on the canvas
+    sub_h = int(h/rows) 
+    sub_w = int(w/cols)
+    if tiled:
+        bands = mosaic_bands(files, (w, h), (sub_w, sub_h), rows, sub_fig, font)
+        save_bands(bands, (w, h), outfile)
+        render_cache.store(key, outfile)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        panels = list(pool.map(lambda f: load_thumbnail(f, (sub_w, sub_h)), files))
     
     # canvas in which all subplots will be placed upon
     canvas = PIL.Image.new("RGB", (w, h), 'white')
     
-    for index, f in enumerate(files):
-        # open each individual plot
-        img = PIL.Image.open(f)
-        
-        # alter the height and width for each plot so they can fit snuggly on the canvas
-        sub_h = int(h/2) 
-        sub_w = int(w/(len(files)/2))
-        img.thumbnail((sub_w, sub_h), PIL.Image.ANTIALIAS)
-        
+    for index, img in enumerate(panels):
         # estimate where the plot will be placed on the canvas
-        x = index // 2 * sub_w 
-        y = index % 2 * sub_h
-        img_w, img_h = img.size # these measurements are diff from sub_h and sub_w, no idea why
-        print('pos {0},{1} size {2},{3}'.format(x, y, img_w, img_h))
+        x = index // rows * sub_w 
+        y = index % rows * sub_h
+        img_w, img_h = img.size # thumbnail keeps the aspect ratio so can be smaller than sub_w and sub_h
+        logging.debug('pos {0},{1} size {2},{3}'.format(x, y, img_w, img_h))
         canvas.paste(img, (x, y, x + img_w, y + img_h))
 
     if sub_fig:
         fnt_size = int((w+h)/120)
-        fnt = PIL.ImageFont.truetype(font, fnt_size)
-        PIL.ImageDraw.Draw(canvas).text((sub_w/40, 0), "a", fill=0, font=fnt)
-        PIL.ImageDraw.Draw(canvas).text((sub_w+(sub_w/20), 0), "c", fill=0, font=fnt)
-        PIL.ImageDraw.Draw(canvas).text((sub_w/40,sub_h), "b", fill=0, font=fnt)
-        PIL.ImageDraw.Draw(canvas).text((sub_w+(sub_w/20),sub_h), "d", fill=0, font=fnt)
+        fnt = load_font(font, fnt_size)
+        draw = PIL.ImageDraw.Draw(canvas)
+        for index in range(len(files)):
+            col, row = divmod(index, rows)
+            x = col * sub_w + (sub_w/40 if col == 0 else sub_w/20)
+            draw.text((x, row * sub_h), panel_label(index), fill=0, font=fnt)
+
+    atomic_save(canvas, outfile)
+    render_cache.store(key, outfile)
+
+def mosaic_bands(files, size, sub_size, rows, sub_fig=None, font="Verdana.ttf"):
+    ''' Generate the output of create_subplot as horizontal bands, one per row
+        of subplots, opening each image only while it is placed.
+
+    Args:
+        files: list of files to merge
+        size: pixel size of the output (width, height)
+        sub_size: pixel size of each subplot (width, height)
+        rows: number of rows of subplots
+        sub_fig: add figure number to the corner of each subplot 
+        font: font used for sub_fig markings
+
+    Returns:
+        generator of RGB images which stack from top to bottom into the output
+    '''
+    w, h = size
+    sub_w, sub_h = sub_size
+    fnt = load_font(font, int((w+h)/120)) if sub_fig else None
+
+    for row in range(rows):
+        band = PIL.Image.new("RGB", (w, sub_h), 'white')
+        draw = PIL.ImageDraw.Draw(band) if sub_fig else None
+        # the files in a row are every rows-th file as subplots fill columns first
+        for index in range(row, len(files), rows):
+            col = index // rows
+            img = load_thumbnail(files[index], sub_size)
+            band.paste(img, (col * sub_w, 0))
+            img.close()
+            if sub_fig:
+                x = col * sub_w + (sub_w/40 if col == 0 else sub_w/20)
+                draw.text((x, 0), panel_label(index), fill=0, font=fnt)
+        yield band
+
+    # rounding the subplot size down can leave a strip at the bottom
+    if h > rows * sub_h:
+        yield PIL.Image.new("RGB", (w, h - rows * sub_h), 'white')
 
-    canvas.save(outfile)
+def save_bands(bands, size, outfile):
+    ''' Save horizontal bands of an image, writing each band as it arrives
+        when outfile is a PNG, PPM or PGM.
 
-def correct_size(f, size):
+    Args:
+        bands: iterable of images which stack from top to bottom into the image
+        size: pixel size of the whole image (width, height)
+        outfile: name of output, its extension decides the image format
+    '''
+    name = outfile if isinstance(outfile, str) else getattr(outfile, 'name', '')
+    ext = os.path.splitext(str(name))[1].lower()
+    writers = {'.png': write_png_bands, '.ppm': write_ppm_bands, '.pgm': write_ppm_bands}
+    if ext not in writers:
+        canvas = PIL.Image.new("RGB", size, 'white')
+        y = 0
+        for band in bands:
+            canvas.paste(band, (0, y))
+            y += band.size[1]
+        atomic_save(canvas, outfile)
+        return
+
+    # PGM is written in grayscale
+    mode = 'L' if ext == '.pgm' else 'RGB'
+    bands = (band if band.mode == mode else band.convert(mode) for band in bands)
+    if hasattr(outfile, 'write'):
+        writers[ext](bands, size, mode, outfile)
+        return
+    with atomic_output(outfile) as tmp, open(tmp, 'wb') as f:
+        writers[ext](bands, size, mode, f)
+
+def write_png_bands(bands, size, mode, f):
+    ''' Write bands of an 8 bit 'RGB' or 'L' image to a binary file as a PNG,
+        compressing each band as it arrives.
+    '''
+    def chunk(kind, data):
+        f.write(struct.pack('>I', len(data)) + kind + data)
+        f.write(struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    w, h = size
+    f.write(b'\x89PNG\r\n\x1a\n')
+    chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 2 if mode == 'RGB' else 0, 0, 0, 0))
+    compressor = zlib.compressobj(6)
+    for band in bands:
+        pixels = np.asarray(band).reshape(band.size[1], -1)
+        # compress a few scanlines at a time, each starting with filter type 0 (none)
+        for start in range(0, len(pixels), 64):
+            rows = pixels[start:start + 64]
+            scanlines = np.hstack([np.zeros((len(rows), 1), dtype=np.uint8), rows])
+            data = compressor.compress(scanlines.tobytes())
+            if data:
+                chunk(b'IDAT', data)
+    chunk(b'IDAT', compressor.flush())
+    chunk(b'IEND', b'')
+
+def write_ppm_bands(bands, size, mode, f):
+    ''' Write bands of an 8 bit 'RGB' or 'L' image to a binary file as a PPM or PGM.
+    '''
+    f.write('{} {} {}\n255\n'.format('P6' if mode == 'RGB' else 'P5', *size).encode())
+    for band in bands:
+        f.write(band.tobytes())
+
+def panel_label(index):
+    ''' Get the sub figure label of a panel in the style of spreadsheet columns,
+        a to z followed by aa, ab and so on.
+
+    Args:
+        index: position of the panel, starting at 0
+
+    Returns:
+        label string
+    '''
+    label = ''
+    index += 1
+    while index:
+        index, letter = divmod(index - 1, 26)
+        label = string.ascii_lowercase[letter] + label
+    return label
+
+def load_thumbnail(f, size):
+    ''' Open an image and shrink it to fit within the given size.
+
+    Args:
+        f: image file
+        size: maximum resolution in pixels in a tuple (width, height)
+
+    Returns:
+        the shrunken image, fully loaded so the file can be closed
+
+    Notes:
+        JPEGs are decoded at a reduced scale via draft and other formats
+        are reduced by an integer factor before resampling, so large
+        panels are not fully resampled just to be shrunk
+    '''
+    with PIL.Image.open(f) as img:
+        img.draft('RGB', size)
+        img.thumbnail(size, PIL.Image.LANCZOS, reducing_gap=2.0)
+        img.load()
+    return img
+
+def image_sizes(files):
+    ''' Get the resolution of each image by reading only its header.
+
+    Args:
+        files: list of image files
+
+    Returns:
+        list of resolutions in tuples (width, height)
+    '''
+    sizes = []
+    for f in files:
+        with PIL.Image.open(f) as img:
+            sizes.append(img.size)
+    return sizes
+
+def correct_size(f, size, rows=2, cols=None):
     ''' Adjust the given size so that the given files can fit 
         closely side by side within a subplot.
     
     Args:
         f: list of image files
         size: resoltion in pixels in a tuple (width, height)
+        rows: number of rows of subplots
+        cols: number of columns of subplots, by default enough to fit all files in the rows
     
     Returns:
         altered size in a tuple
     
     '''
+    if cols is None:
+        cols = int(math.ceil(len(f) / rows))
+
     # get the average width and height for all parsed image files
-    avg_w = sum([Image.open(s).size[0]for s in f]) /len(f)
-    avg_h = sum([Image.open(s).size[1]for s in f]) /len(f)
+    sizes = image_sizes(f)
+    avg_w = sum([s[0] for s in sizes]) / len(sizes)
+    avg_h = sum([s[1] for s in sizes]) / len(sizes)
     # calulate the ratio of width to height and use ratio to recalculate height
     r = avg_w/avg_h
     w, h = size
-    h = int((w/r)*(4/len(f)))
+    h = int((w/r)*(rows/cols))
     return (w, h)
     
 
@@ -206,18 +611,22 @@ def figure_box(f, msg, outfile, extend=100, font="Verdana.ttf", font_size=20, x_
         x_text: specify the position where the text begins on the x-axis
     
     '''
+    hit, key = render_cache.lookup('figure_box', outfile, (msg, extend, font, font_size, x_text), files=[f])
+    if hit:
+        return
+
     img = PIL.Image.open(f)
     x, y = img.size
     result = PIL.Image.new("RGB", (x, y+extend), 'white')
     result.paste(img, (0, 0))
-    fnt = PIL.ImageFont.truetype(font, font_size)
+    fnt = load_font(font, font_size)
     draw_word_wrap(img=result, text=msg, 
                    xpos=0+x_text, ypos=y, 
                    max_width=x-(x_text*2), font=fnt)
-    result.save(outfile)
+    atomic_save(result, outfile)
+    render_cache.store(key, outfile)
 
-def draw_word_wrap(img, text, xpos=0, ypos=0, max_width=130, fill=(0,0,0), 
-                   font=ImageFont.truetype("Verdana.ttf", 50)):
+def draw_word_wrap(img, text, xpos=0, ypos=0, max_width=130, fill=(0,0,0), font=None):
     ''' Draw the given ``text`` to the x and y position of the image, using
         the minimum length word-wrapping algorithm to restrict the text to
         a pixel width of ``max_width.``
@@ -229,20 +638,23 @@ def draw_word_wrap(img, text, xpos=0, ypos=0, max_width=130, fill=(0,0,0),
         ypos: y position to begin writing
         max_width: maximum length on y-axis before text wrapping begins
         fill: text colour
-        font: font and font size
+        font: font and font size, by default Verdana at size 50
     
     Notes:
         Taken from: https://gist.github.com/atorkhov/5403562
     '''
+    if font is None:
+        font = load_font("Verdana.ttf", 50)
     draw = PIL.ImageDraw.Draw(img)
-    text_size_x, text_size_y = draw.textsize(text, font=font)
+    # a fixed string with an ascender and descender so the caption itself is not cached
+    line_height = text_size('Ay', font)[1]
     remaining = max_width
-    space_width, space_height = draw.textsize(' ', font=font)
+    space_width, space_height = text_size(' ', font)
     # use this list as a stack, push/popping each line
     output_text = []
     # split on whitespace...    
     for word in text.split(None):
-        word_width, word_height = draw.textsize(word, font=font)
+        word_width, word_height = text_size(word, font)
         if word_width + space_width > remaining:
             output_text.append(word)
             remaining = max_width - word_width
@@ -256,16 +668,107 @@ def draw_word_wrap(img, text, xpos=0, ypos=0, max_width=130, fill=(0,0,0),
             remaining = remaining - (word_width + space_width)
     for text in output_text:
         draw.text((xpos, ypos), text, font=font, fill=fill)
-        ypos += text_size_y
+        ypos += line_height
+
+@lru_cache(maxsize=64)
+def load_font(font, size):
+    ''' Load a TrueType font once for each font and size.
+
+    Args:
+        font: font file or name
+        size: font size
+
+    Returns:
+        the loaded font
+    '''
+    return ImageFont.truetype(font, size)
+
+@lru_cache(maxsize=4096)
+def text_size(text, font):
+    ''' Measure the width and height of text drawn in the given font.
+
+    Args:
+        text: text to measure
+        font: loaded font, see load_font
+
+    Returns:
+        width and height in pixels in a tuple
 
-def convert2grayscale(f):
+    Notes:
+        measurements are cached per font so repeated words are only measured once
+    '''
+    if hasattr(font, 'getbbox'):
+        left, top, right, bottom = font.getbbox(text)
+        return (right, bottom)
+    return font.getsize(text)
+
+def convert2grayscale(f, outfile=None):
     ''' Convert a colour image to grascale
     
     Args:
         f: absolute path to file to be converted
+        outfile: name of output, by default the original file
         
     Notes:
-        This overwrites the original file
+        This overwrites the original file unless outfile is given. The original
+        file is only replaced once the grayscale image has been fully written.
     '''
-    img = Image.open(f).convert('LA')
-    img.save(f)
+    outfile = outfile or f
+    hit, key = render_cache.lookup('convert2grayscale', outfile, (), files=[f])
+    if hit:
+        return
+
+    with Image.open(f) as img:
+        gray = img.convert('LA')
+    atomic_save(gray, outfile)
+    render_cache.store(key, outfile)
+
+def atomic_save(img, outfile):
+    ''' Save an image to a temporary file next to outfile and then rename
+        it to outfile, so outfile is never left partially written.
+
+    Args:
+        img: image to save
+        outfile: name of output, its extension decides the image format
+    '''
+    # file objects are written directly
+    if hasattr(outfile, 'write'):
+        img.save(outfile)
+        return
+
+    with atomic_output(outfile) as tmp:
+        img.save(tmp)
+
+@contextmanager
+def atomic_output(outfile):
+    ''' Yield the name of a temporary file next to outfile which replaces
+        outfile once the with block succeeds and is removed otherwise.
+
+    Args:
+        outfile: name of output
+
+    Notes:
+        outfile keeps its permissions if it exists and otherwise gets those of a
+        newly created file
+    '''
+    directory, name = os.path.split(os.path.abspath(outfile))
+    prefix, suffix = os.path.join(directory, '.' + name), os.path.splitext(name)[1]
+    while True:
+        tmp = prefix + os.urandom(6).hex() + suffix
+        try:
+            # opened with the mode of a new file so the system applies the umask to it
+            os.close(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+            break
+        except FileExistsError:
+            continue
+
+    try:
+        yield tmp
+        try:
+            os.chmod(tmp, os.stat(outfile).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp, outfile)
+    except BaseException:
+        os.remove(tmp)
+        raise
@@ -0,0 +1,229 @@
+''' A content addressed cache of rendered figures, so rebuilding a report only
+    redraws the figures whose data, arguments or source images have changed
+
+Example:
+    with cache_renders('.render_cache', max_mb=512):
+        render_piechart(df, "Status", "Sex", "pie.png")
+        figure_box("pie.png", "Figure 1. ...", "pie_box.png")
+
+grouped_piechart.render_piechart, create_subplot, figure_box and
+convert2grayscale look up their output in the active cache before rendering
+it and store it afterwards. grouped_piechart itself always draws, as it
+returns the axes it draws on.
+Outputs written to file objects are never cached. The process pools of
+batch_images and grouped_piechart.render_csv use the cache active when they
+are called.
+'''
+import fcntl
+import hashlib
+import os
+import shutil
+from contextlib import contextmanager
+
+# bump to invalidate existing caches when the rendering of the tools changes
+CACHE_VERSION = 1
+
+_cache = {}
+
+
+def enable(directory, max_mb=512):
+    ''' Start caching renders in a directory, shared with any other process using it.
+
+    Args:
+        directory: directory to store the rendered outputs in
+        max_mb: size of the cache in MB above which the least recently used outputs are removed
+
+    Notes:
+        the recency of an output is its modification time, which is updated on every
+        hit, so processes sharing the directory agree on which outputs to remove.
+        The cache is trimmed to its size when enabled in case it has shrunk.
+    '''
+    os.makedirs(directory, exist_ok=True)
+    _cache.clear()
+    _cache.update(directory=directory, max_bytes=max_mb * 2**20, counts={})
+    trim()
+
+
+def disable():
+    ''' Stop caching renders.
+    '''
+    _cache.clear()
+
+
+@contextmanager
+def cache_renders(directory, max_mb=512, report=True):
+    ''' Cache renders within the with block.
+
+    Args:
+        directory: see enable
+        max_mb: see enable
+        report: print the hits and misses of each tool at the end of the block
+
+    Yields:
+        dictionary where the key is the tool and the item is a dictionary of its
+        hits, misses and evictions
+    '''
+    enable(directory, max_mb)
+    counts = _cache['counts']
+    try:
+        yield counts
+    finally:
+        disable()
+        if report:
+            print_report(counts)
+
+
+def lookup(tool, outfile, params, files=(), df=None):
+    ''' Restore the output of a render from the cache if it is there.
+
+    Args:
+        tool: name of the tool rendering
+        outfile: name of the output
+        params: tuple of the arguments which change the output
+        files: input files whose bytes change the output
+        df: DataFrame whose values change the output
+
+    Returns:
+        True if outfile was restored and the key to store the render under, which
+        is None when no cache is active or outfile is a file object
+    '''
+    if not _cache or hasattr(outfile, 'write'):
+        return False, None
+
+    key = render_key(tool, params, files, df) + os.path.splitext(outfile)[1].lower()
+    path = os.path.join(_cache['directory'], key)
+    try:
+        copy_atomic(path, outfile)
+        os.utime(path)
+    except FileNotFoundError:
+        # never rendered or removed by another process sharing the cache
+        count(tool, 'misses')
+        return False, (tool, key)
+
+    count(tool, 'hits')
+    return True, (tool, key)
+
+
+def store(key, outfile):
+    ''' Store a rendered output under the key returned by lookup, removing the least
+        recently used outputs if the cache grows beyond its size.
+
+    Args:
+        key: key from lookup, nothing is stored if it is None
+        outfile: name of the rendered output
+    '''
+    if key is None or not _cache:
+        return
+    tool, key = key
+    copy_atomic(outfile, os.path.join(_cache['directory'], key))
+    trim(tool, key)
+
+
+def trim(tool=None, keep=None):
+    ''' Remove the least recently used outputs until the cache is within its size.
+
+    Args:
+        tool: tool to count the evictions against
+        keep: output which is kept even if it is larger than the cache
+
+    Notes:
+        the directory is rescanned under a lock file, so the size holds however
+        many processes are storing outputs in it
+    '''
+    directory = _cache['directory']
+    with open(os.path.join(directory, '.lock'), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        entries = []
+        # temporary files and the lock start with a dot
+        for entry in os.scandir(directory):
+            if not entry.name.startswith('.'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+
+        total = sum(size for mtime, name, size in entries)
+        for mtime, name, size in sorted(entries):
+            if total <= _cache['max_bytes']:
+                break
+            if name == keep:
+                continue
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+            if tool:
+                count(tool, 'evictions')
+
+
+def render_key(tool, params, files=(), df=None):
+    ''' Hash the tool, its arguments, the bytes of its input files and the values of
+        its DataFrame into a hex digest.
+    '''
+    digest = hashlib.sha1(repr((CACHE_VERSION, tool, params)).encode())
+    for f in files:
+        with open(f, 'rb') as handle:
+            for block in iter(lambda: handle.read(2**20), b''):
+                digest.update(block)
+    if df is not None:
+        import pandas as pd
+        digest.update(repr(list(df.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def copy_atomic(src, dst):
+    ''' Copy src to a temporary file next to dst and rename it to dst, with the
+        permissions given by plot_manipulations.atomic_output.
+    '''
+    from .plot_manipulations import atomic_output
+    with atomic_output(dst) as tmp:
+        shutil.copyfile(src, tmp)
+
+
+def count(tool, outcome, n=1):
+    # add to the hits, misses or evictions of a tool
+    counts = _cache['counts'].setdefault(tool, {'hits': 0, 'misses': 0, 'evictions': 0})
+    counts[outcome] += n
+
+
+def settings():
+    ''' Get the arguments of enable for the active cache, so process pools can
+        enable it in their workers, or an empty tuple when there is no active cache.
+    '''
+    if not _cache:
+        return ()
+    return _cache['directory'], _cache['max_bytes'] / 2**20
+
+
+def counted(func, task):
+    ''' Run func(task) in a process pool worker and return its result along with the
+        cache counts it caused, to be added to the parent's counts with add_counts.
+    '''
+    counts = _cache.get('counts', {})
+    before = dict((tool, dict(c)) for tool, c in counts.items())
+    result = func(task)
+    delta = {}
+    for tool, c in counts.items():
+        delta[tool] = dict((outcome, n - before.get(tool, {}).get(outcome, 0)) for outcome, n in c.items())
+    return result, delta
+
+
+def add_counts(delta):
+    ''' Add the counts returned by counted to those of the active cache.
+    '''
+    if not _cache:
+        return
+    for tool, c in delta.items():
+        for outcome, n in c.items():
+            count(tool, outcome, n)
+
+
+def print_report(counts):
+    ''' Print the hits, misses and evictions of each tool.
+    '''
+    print("{:>18} {:>8} {:>8} {:>10}".format('render cache', 'hits', 'misses', 'evictions'))
+    for tool, c in counts.items():
+        print("{:>18} {:>8} {:>8} {:>10}".format(tool, c['hits'], c['misses'], c['evictions']))
@@ -0,0 +1,295 @@
+''' A long-lived local render service which keeps matplotlib, scipy and fonts
+    loaded in a pool of workers so small figures are drawn in milliseconds
+
+Usage:
+    python -m snsTools.render_daemon serve --workers 4 &
+    python -m snsTools.render_daemon submit manifest.json
+    python -m snsTools.render_daemon stop
+
+Requests are the operation dictionaries of batch_images, for example
+    {"op": "piechart", "data": "cohort.csv", "group": "Status", "qual": "Sex", "output": "pie.png"}
+    {"op": "caption", "input": "a.png", "output": "a_box.png", "msg": "Figure 1. ..."}
+    {"op": "mosaic", "inputs": ["a.png", "b.png"], "output": "ab.png", "rows": 1}
+
+From python:
+    from snsTools.render_daemon import render
+    render([{"op": "caption", ...}, {"op": "mosaic", ...}])
+
+The socket and an authentication key are kept in a directory only its user
+can access, $XDG_RUNTIME_DIR/snsTools or ~/.snsTools when that is not set.
+Requests and replies are pickled so both ends must prove they hold the key
+before anything is received.
+'''
+import argparse
+import io
+import json
+import os
+import stat
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, answer_challenge, deliver_challenge
+
+
+def runtime_dir():
+    ''' Get the directory holding the socket and key, creating it if needed.
+
+    Returns:
+        path of a directory owned by and only accessible to the current user
+
+    Notes:
+        a RuntimeError is raised if the directory belongs to another user
+    '''
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        directory = os.path.join(os.environ['XDG_RUNTIME_DIR'], 'snsTools')
+    else:
+        directory = os.path.join(os.path.expanduser('~'), '.snsTools')
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise RuntimeError("runtime_dir: {} is not a directory owned by the current user".format(directory))
+    if info.st_mode & 0o077:
+        os.chmod(directory, 0o700)
+    return directory
+
+
+def default_address():
+    ''' Get the path of the socket the service listens on by default.
+    '''
+    return os.path.join(runtime_dir(), 'render.sock')
+
+
+def load_authkey(create=False):
+    ''' Read the key clients and the service authenticate each other with.
+
+    Args:
+        create: write a new random key if there is none
+
+    Returns:
+        the key as bytes
+    '''
+    path = os.path.join(runtime_dir(), 'authkey')
+    if create and not os.path.exists(path):
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass  # written by another service starting at the same time
+        else:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(os.urandom(32).hex().encode())
+    with open(path, 'rb') as f:
+        return f.read().strip()
+
+
+def warm_up(font="Verdana.ttf"):
+    ''' Import the plotting libraries and draw a throwaway piechart so the
+        first request in a worker does not pay for them.
+
+    Args:
+        font: font to load for figure_box and create_subplot markings
+    '''
+    import pandas as pd
+    from . import plot_manipulations as pm
+    from .grouped_piechart import grouped_piechart, plt
+
+    df = pd.DataFrame({'group': ['a', 'a', 'b', 'b'], 'qual': ['x', 'y', 'x', 'y']})
+    ax = grouped_piechart(df, 'group', 'qual', outfile=io.BytesIO())
+    plt.close(ax.figure)
+    try:
+        pm.load_font(font, 50)
+    except OSError:
+        pass
+
+
+def serve(address=None, workers=None, font="Verdana.ttf"):
+    ''' Run the render service until a client sends a stop request.
+
+    Args:
+        address: path of the Unix socket to listen on, by default default_address()
+        workers: number of render processes, by default the number of CPUs
+        font: font to preload in each worker
+
+    Notes:
+        every worker is warmed up before the first connection is accepted and
+        each connection is authenticated and served by its own thread, so
+        requests from many clients are rendered concurrently and a client which
+        stalls does not hold up the others
+    '''
+    address = address or default_address()
+    authkey = load_authkey(create=True)
+    if os.path.exists(address):
+        try:
+            Client(address, family='AF_UNIX', authkey=authkey).close()
+        except OSError:
+            # left behind by a service which did not shut down
+            os.remove(address)
+        else:
+            raise RuntimeError("serve: a render service is already listening on {}".format(address))
+
+    workers = workers or os.cpu_count()
+    service = {'pool': start_pool(workers, font), 'lock': threading.Lock(), 'workers': workers, 'font': font}
+
+    # clients are authenticated by the thread serving them rather than while accepting
+    listener = Listener(address, family='AF_UNIX')
+    os.chmod(address, 0o600)
+    stopping = threading.Event()
+    try:
+        while not stopping.is_set():
+            try:
+                conn = listener.accept()
+            except OSError:
+                continue
+            threading.Thread(target=handle, args=(conn, service, stopping, address, authkey), daemon=True).start()
+    finally:
+        listener.close()
+        service['pool'].shutdown()
+
+
+def start_pool(workers, font):
+    ''' Start a pool of render processes and wait for them to warm up.
+    '''
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=warm_up, initargs=(font,))
+    # submitting one task per worker starts them all and waits for their warm up
+    list(pool.map(time.sleep, [0] * workers))
+    return pool
+
+
+def replace_pool(service, broken):
+    ''' Start a new pool in place of one whose process died, unless another
+        thread already has.
+
+    Returns:
+        the pool to submit to
+    '''
+    with service['lock']:
+        if service['pool'] is broken:
+            broken.shutdown(wait=False)
+            service['pool'] = start_pool(service['workers'], service['font'])
+        return service['pool']
+
+
+def handle(conn, service, stopping, address, authkey):
+    ''' Authenticate a client and answer the requests sent over its connection
+        until it closes it.
+
+    Args:
+        conn: multiprocessing connection to a client
+        service: dictionary holding the pool to render with, see serve
+        stopping: event set when a client asks the service to stop
+        address: path of the Unix socket the service listens on
+        authkey: key of the service
+
+    Notes:
+        each message is a list of operation dictionaries and is answered with a
+        list, in the same order, of a dictionary per operation with either the
+        keys op and seconds or the key error. If a render process dies, the
+        operations it took down are answered with an error and the pool is
+        replaced, so later requests are rendered as normal.
+    '''
+    # imported here so clients do not load the plotting libraries
+    from .batch_images import run_operation
+
+    with conn:
+        try:
+            deliver_challenge(conn, authkey)
+            answer_challenge(conn, authkey)
+        except (OSError, EOFError, AuthenticationError):
+            # a client without the key, or the connection waking the main thread to stop
+            return
+
+        while True:
+            try:
+                tasks = conn.recv()
+            except EOFError:
+                return
+
+            if tasks == 'stop':
+                stopping.set()
+                conn.send('stopped')
+                # wake the main thread which is blocked waiting for a connection
+                Client(address, family='AF_UNIX').close()
+                return
+
+            pool = service['pool']
+            try:
+                futures = [pool.submit(run_operation, task) for task in tasks]
+            except BrokenProcessPool:
+                # none of the tasks ran yet, so they are submitted again to a new pool
+                pool = replace_pool(service, pool)
+                futures = [pool.submit(run_operation, task) for task in tasks]
+
+            replies = []
+            for future in futures:
+                try:
+                    op, seconds = future.result()
+                    replies.append({'op': op, 'seconds': seconds})
+                except Exception as e:
+                    replies.append({'error': "{}: {}".format(type(e).__name__, e)})
+                    if isinstance(e, BrokenProcessPool):
+                        replace_pool(service, pool)
+            conn.send(replies)
+
+
+def render(tasks, address=None):
+    ''' Send operations to a running render service and wait for them to finish.
+
+    Args:
+        tasks: an operation dictionary or a list of them, see batch_images
+        address: path of the Unix socket the service listens on, by default default_address()
+
+    Returns:
+        list of the seconds each operation took to render
+
+    Notes:
+        the operations in a call are rendered concurrently, a RuntimeError listing
+        the failures is raised after all of them finish if any fail
+    '''
+    if isinstance(tasks, dict):
+        tasks = [tasks]
+    with Client(address or default_address(), family='AF_UNIX', authkey=load_authkey()) as conn:
+        conn.send(list(tasks))
+        replies = conn.recv()
+
+    errors = ["{}: {}".format(i, r['error']) for i, r in enumerate(replies) if 'error' in r]
+    if errors:
+        raise RuntimeError("render: {} of {} operations failed\n{}".format(len(errors), len(replies), "\n".join(errors)))
+    return [r['seconds'] for r in replies]
+
+
+def stop(address=None):
+    ''' Ask a running render service to finish its requests and exit.
+    '''
+    with Client(address or default_address(), family='AF_UNIX', authkey=load_authkey()) as conn:
+        conn.send('stop')
+        conn.recv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--socket', default=None, help='path of the Unix socket, by default in the runtime directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    server = commands.add_parser('serve', help='start the render service')
+    server.add_argument('--workers', type=int, default=None, help='number of processes')
+    server.add_argument('--font', default="Verdana.ttf", help='font to preload')
+    submit = commands.add_parser('submit', help='render the operations in a JSON manifest')
+    submit.add_argument('manifest', help='JSON file listing the operations to run')
+    commands.add_parser('stop', help='stop the render service')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.socket, args.workers, args.font)
+    elif args.command == 'submit':
+        with open(args.manifest) as f:
+            manifest = json.load(f)
+        start = time.perf_counter()
+        seconds = render(manifest, args.socket)
+        print("rendered {} operations in {:.3f} seconds".format(len(seconds), time.perf_counter() - start))
+    else:
+        stop(args.socket)
+
+
+if __name__ == '__main__':
+    main()
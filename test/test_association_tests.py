@@ -0,0 +1,42 @@
+''' Checks of the batched association tests
+'''
+import numpy as np
+import pandas as pd
+from scipy import stats
+from snsTools import association_tests as at
+
+
+def cohort(n=300, seed=0):
+    rng = np.random.RandomState(seed)
+    return pd.DataFrame({'Status': rng.choice(['case', 'control'], n),
+                         'Site': rng.choice(['a', 'b', 'c'], n),
+                         'Sex': rng.choice(['Male', 'Female', None], n),
+                         'Smoker': rng.choice(['yes', 'no'], n)})
+
+
+def test_two_by_two_uses_fisher():
+    df = cohort()
+    results = at.association_tests(df, 'Status', ['Smoker', 'Sex'], correction=None)
+    smoker = results.set_index('qual').loc['Smoker']
+    assert smoker['test'] == 'fisher'
+    assert smoker['pvalue'] == stats.fisher_exact(pd.crosstab(df['Status'], df['Smoker']).values)[1]
+    assert results.set_index('qual').loc['Sex', 'test'] == 'chi2'
+
+
+def test_more_than_two_groups_uses_chi2():
+    df = cohort()
+    results = at.association_tests(df, 'Site', ['Smoker', 'Sex'], correction=None).set_index('qual')
+    assert (results['test'] == 'chi2').all()
+    table = pd.crosstab(df['Site'], df['Smoker'])
+    assert results.loc['Smoker', 'pvalue'] == stats.chi2_contingency(table.values)[1]
+
+
+def test_cache_is_bounded():
+    at._cache.clear()
+    for seed in range(at.CACHE_SIZE + 5):
+        at.association_tests(cohort(50, seed), 'Status', ['Smoker'])
+    assert len(at._cache) == at.CACHE_SIZE
+
+    first = at.association_tests(cohort(50, at.CACHE_SIZE), 'Status', ['Smoker'])
+    assert len(at._cache) == at.CACHE_SIZE
+    pd.testing.assert_frame_equal(first, at.association_tests(cohort(50, at.CACHE_SIZE), 'Status', ['Smoker']))
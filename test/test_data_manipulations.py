@@ -0,0 +1,79 @@
+''' Checks of the table readers and the single pass replacement of strings in a column
+'''
+import pathlib
+import numpy as np
+import pandas as pd
+import pytest
+from snsTools.data_manipulations import compile_replacements, apply_replacements, replace_series_strings
+from snsTools.data_manipulations import is_parquet, load_table, write_table
+
+
+def test_overlapping_keys_leftmost_then_longest():
+    matcher = compile_replacements({'cleft': 'CL', 'cleft palate': 'CP', 'palate': 'P', 'lip': 'L'})
+    series = pd.Series(['cleft palate', 'cleft lip', 'palate cleft', 'cleft palatelip'])
+    assert apply_replacements(series, matcher).tolist() == ['CP', 'CL L', 'P CL', 'CPL']
+
+
+def test_overlapping_keys_ignore_key_order():
+    keys = [('ab', '1'), ('abc', '2'), ('bcd', '3'), ('c', '4')]
+    series = pd.Series(['abcd', 'xbcdab', 'cabc'])
+    results = set()
+    for order in (keys, keys[::-1], keys[1:] + keys[:1]):
+        results.add(tuple(apply_replacements(series, compile_replacements(dict(order))).tolist()))
+    assert results == {('2d', 'x31', '42')}
+
+
+def test_replacements_are_not_searched_again():
+    matcher = compile_replacements({'a': 'b', 'b': 'c'})
+    assert apply_replacements(pd.Series(['ab']), matcher).tolist() == ['bc']
+
+
+def test_whole_cell_replacement():
+    matcher = compile_replacements({'lip': 'cleft lip', 'heart': 'CHD'}, substring=False)
+    series = pd.Series(['upper lip', 'heart defect', 'seizures'])
+    assert apply_replacements(series, matcher).tolist() == ['cleft lip', 'CHD', 'seizures']
+
+
+@pytest.mark.parametrize('substring', [True, False])
+def test_missing_and_non_strings_pass_through(substring):
+    matcher = compile_replacements({'a': 'b'}, substring)
+    series = pd.Series(['a', None, np.nan, 3, 'a'], index=[5, 4, 3, 2, 1], name='col')
+    result = apply_replacements(series, matcher)
+    assert result.tolist()[0] == 'b' and result.tolist()[-1] == 'b'
+    assert result[4] is None and np.isnan(result[3]) and result[2] == 3
+    assert list(result.index) == [5, 4, 3, 2, 1] and result.name == 'col'
+
+
+@pytest.mark.parametrize('substring', [True, False])
+def test_single_pass_matches_compiled(substring):
+    dic = {'cleft': 'CL', 'lip': 'L'}
+    df = pd.DataFrame({'Phenotype': ['cleft lip', 'lip', None, 'none']})
+    single = replace_series_strings(df.copy(), 'Phenotype', dic, substring, single_pass=True)
+    compiled = replace_series_strings(df.copy(), 'Phenotype', compile_replacements(dic, substring))
+    pd.testing.assert_frame_equal(single, compiled)
+
+
+def test_mismatched_substring_setting_raises():
+    df = pd.DataFrame({'Phenotype': ['cleft lip']})
+    matcher = compile_replacements({'lip': 'L'}, substring=False)
+    assert replace_series_strings(df.copy(), 'Phenotype', matcher, substring=False)['Phenotype'].tolist() == ['L']
+    with pytest.raises(ValueError):
+        replace_series_strings(df.copy(), 'Phenotype', matcher, substring=True)
+    with pytest.raises(TypeError):
+        replace_series_strings(df.copy(), 'Phenotype', {'lip': 'L'}, substring='yes')
+
+
+def test_is_parquet_accepts_paths():
+    assert is_parquet('variants.PQ') and is_parquet(pathlib.Path('data/variants.parquet'))
+    assert not is_parquet('variants.csv') and not is_parquet(pathlib.Path('variants.csv'))
+
+
+@pytest.mark.parametrize('name', ['variants.parquet', 'variants.csv'])
+def test_tables_round_trip_through_paths(tmp_path, name):
+    df = pd.DataFrame({'Sample': ['a', 'b', 'a'], 'AB': [0.1, 0.5, 0.9]})
+    f = tmp_path / name
+    write_table(df, f)
+    assert f.read_bytes().startswith(b'PAR1') == name.endswith('.parquet')
+    loaded = load_table(f, ['Sample', 'AB'])
+    assert loaded['Sample'].dtype.name == 'category'
+    pd.testing.assert_frame_equal(loaded.astype({'Sample': object}), df.astype({'Sample': object}))
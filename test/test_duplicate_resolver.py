@@ -0,0 +1,91 @@
+''' Randomised checks of the duplicate resolution against simpler reference
+    implementations
+'''
+import random
+import numpy as np
+import pandas as pd
+import pytest
+from snsTools import duplicate_resolver as dr
+
+DUP_ENDS = ['_2', '_3', '_pool7A', '_pool10A']
+
+
+def random_cohort(rng, n, roots=8):
+    samples = ['S%04d' % rng.randint(0, roots) + rng.choice(['', '', '_2', '_3', '_pool7A', '_pool10A'])
+               for _ in range(n)]
+    df = pd.DataFrame({'Sample': samples,
+                       'A': [rng.choice([np.nan, '-', 'x', 'y', 'z']) for _ in range(n)],
+                       'B': [rng.choice([np.nan, '-', 'p', 'q']) for _ in range(n)],
+                       'C': range(n)})
+    return df.drop_duplicates('Sample')
+
+
+def rowwise_column_checker(df, columns_names, order=False, recurs=2):
+    # the original implementation, forward filling each pair of neighbouring rows of a duplicate group
+    if recurs < 1:
+        return df
+    df = df.replace('-', np.nan)
+    df['same'] = dr.root_sample_names(df['Sample'], DUP_ENDS)
+    df = df.sort_values(by=['same', 'Sample'], ascending=[False, order]).reset_index(drop=True)
+    col_ix = [df.columns.get_loc(x) for x in columns_names]
+    for num in range(df.shape[0] - 1):
+        if df['same'][num] == df['same'][num + 1]:
+            df.iloc[num:num + 2, col_ix] = df.iloc[num:num + 2, col_ix].ffill(limit=1)
+    return rowwise_column_checker(df, columns_names, order=True, recurs=recurs - 1)
+
+
+@pytest.mark.parametrize('order', [False, True])
+@pytest.mark.parametrize('recurs', [0, 1, 2, 3])
+def test_duplicate_column_checker_matches_rowwise(order, recurs):
+    rng = random.Random(recurs * 2 + order)
+    for trial in range(30):
+        df = random_cohort(rng, rng.randint(1, 30))
+        expected = rowwise_column_checker(df.copy(), ['A', 'B'], order, recurs)
+        result = dr.duplicate_column_checker(df.copy(), ['A', 'B'], order, recurs)
+        pd.testing.assert_frame_equal(result.astype(object), expected.astype(object), check_index_type=False)
+
+
+def test_incremental_matches_full_run(tmp_path):
+    rng = random.Random(9)
+    for trial in range(40):
+        df = random_cohort(rng, rng.randint(1, 40), roots=10)
+        state_dir = str(tmp_path / str(trial))
+        cuts = sorted(set([0, len(df)] + [rng.randint(0, len(df)) for _ in range(3)]))
+        for a, b in zip(cuts, cuts[1:]):
+            batch = df.iloc[a:b]
+            result = dr.incremental_duplicate_resolver(batch, 'Sample', ['A', 'B'], state_dir,
+                                                       warn=False, shards=rng.choice([1, 3, 16]))
+            full = dr.duplicate_resolver(df.iloc[:b], 'Sample', ['A', 'B'], warn=False)
+            pd.testing.assert_frame_equal(dr.resolved_cohort(state_dir, warn=False).astype(object),
+                                          full.astype(object), check_index_type=False)
+
+            touched = full[full['same'].isin(dr.root_sample_names(batch['Sample'], DUP_ENDS))]
+            pd.testing.assert_frame_equal(result.reset_index(drop=True).astype(object),
+                                          touched.reset_index(drop=True).astype(object))
+
+
+def test_incremental_rejects_changed_settings(tmp_path):
+    df = random_cohort(random.Random(0), 10)
+    dr.incremental_duplicate_resolver(df, 'Sample', ['A', 'B'], str(tmp_path), warn=False)
+    with pytest.raises(ValueError):
+        dr.incremental_duplicate_resolver(df, 'Sample', ['A'], str(tmp_path), warn=False)
+
+
+@pytest.mark.parametrize('order', [False, True])
+@pytest.mark.parametrize('recurs', [0, 1, 2])
+def test_sharded_matches_serial(order, recurs):
+    df = pd.concat([random_cohort(random.Random(seed), 40, roots=50) for seed in range(10)],
+                   ignore_index=True).drop_duplicates('Sample')
+    serial = dr.duplicate_column_checker(df.copy(), ['A', 'B'], order, recurs)
+    sharded = dr.sharded_duplicate_column_checker(df.copy(), ['A', 'B'], order, recurs,
+                                                  workers=3, partition_size=50)
+    pd.testing.assert_frame_equal(sharded, serial)
+
+
+def test_unnamed_rows_keep_their_values():
+    df = pd.DataFrame({'Sample': ['GEN0001', None, None, 'GEN0002'],
+                       'Sex': ['Male', 'Female', np.nan, np.nan],
+                       'Status': [np.nan, np.nan, 'Case', np.nan]})
+    result = dr.duplicate_column_checker(df, ['Sex', 'Status'])
+    unnamed = result.loc[result['Sample'].isna(), ['Sex', 'Status']].fillna('')
+    assert sorted(map(tuple, unnamed.values.tolist())) == [('', 'Case'), ('Female', '')]
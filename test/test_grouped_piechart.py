@@ -0,0 +1,14 @@
+''' Checks of the grouped piechart helpers
+'''
+import pytest
+from snsTools import grouped_piechart as gp
+
+
+def test_remove_zeros_is_deprecated_but_still_works():
+    with pytest.warns(DeprecationWarning):
+        percent, strings = gp.remove_zeros([0, 40, 0, 60, 0], ['a', 'b', 'c', 'd', 'e'])
+    assert percent == [40, 60]
+    assert strings == ['b', 'd']
+
+    with pytest.warns(DeprecationWarning):
+        assert gp.remove_zeros([50, 50], ('a', 'b')) == ([50, 50], ('a', 'b'))
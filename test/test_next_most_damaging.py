@@ -0,0 +1,80 @@
+''' Randomised checks of the selection of replacement variants against
+    sorting every variant
+'''
+import io
+import random
+import numpy as np
+import pandas as pd
+import pytest
+from snsTools import next_most_damaging as nmd
+
+
+def random_variants(rng, n, samples=('s1', 's2', '101', '102', '7')):
+    return pd.DataFrame({'Sample': [rng.choice(samples) for _ in range(n)],
+                         'Symbol': [rng.choice(['SKI', 'TP53', 'BRCA1']) for _ in range(n)],
+                         'Exon': [rng.choice(['1/7', '2/7', '3']) for _ in range(n)],
+                         'AB': [rng.choice([0.1, 0.5, 0.9, np.nan]) for _ in range(n)],
+                         'CADD': [rng.choice([1.0, 2.0, 3.0, np.nan]) for _ in range(n)]})
+
+
+def sorted_ranking(df, score, k):
+    # rank by sorting: highest score first, missing scores last and ties by position
+    ranked = df.assign(_score=df[score].fillna(-np.inf), _pos=np.arange(len(df)))
+    ranked = ranked.sort_values(['Sample', '_score', '_pos'], ascending=[True, False, True], kind='mergesort')
+    return df.iloc[ranked.groupby('Sample', sort=False).head(k)['_pos'].values]
+
+
+@pytest.mark.parametrize('k', [1, 2, 5])
+def test_rank_variants_matches_sorting(k):
+    rng = random.Random(k)
+    for trial in range(50):
+        df = random_variants(rng, rng.randint(0, 60))
+        df.index = [rng.randint(0, 5) for _ in range(len(df))]
+        pd.testing.assert_frame_equal(nmd.rank_variants(df, 'CADD', k), sorted_ranking(df, 'CADD', k))
+
+
+def sorted_ranking_by_ab(df, k):
+    # rank by sorting: highest CADD then lowest AB, missing values last and ties by position
+    ranked = df.assign(_cadd=df['CADD'].fillna(-np.inf), _ab=df['AB'].fillna(np.inf), _pos=np.arange(len(df)))
+    ranked = ranked.dropna(subset=['Sample']).sort_values(['Sample', '_cadd', '_ab', '_pos'],
+                                                          ascending=[True, False, True, True], kind='mergesort')
+    return df.iloc[ranked.groupby('Sample', sort=False).head(k)['_pos'].values]
+
+
+@pytest.mark.parametrize('k', [1, 2, 5])
+def test_rank_variants_by_columns_matches_sorting(k):
+    rng = random.Random(k)
+    for trial in range(50):
+        df = random_variants(rng, rng.randint(0, 60))
+        df.index = [rng.randint(0, 5) for _ in range(len(df))]
+        result = nmd.rank_variants(df, ['CADD', 'AB'], k, ascending=[False, True])
+        pd.testing.assert_frame_equal(result, sorted_ranking_by_ab(df, k))
+
+
+@pytest.mark.parametrize('score', [None, 'CADD'])
+@pytest.mark.parametrize('k', [1, 3])
+def test_top_other_variants_matches_ranking_all(score, k):
+    rng = random.Random(k)
+    for trial in range(50):
+        all_vars = random_variants(rng, rng.randint(1, 60))
+        most_dam = all_vars.drop_duplicates('Sample')
+        others = nmd.get_other_variants(most_dam, all_vars, 0.3, 'SKI', '1/7')
+        expected = all_vars.loc[nmd.rank_variants(others, score=score, k=k).index]
+        result = nmd.top_other_variants(most_dam, all_vars, 0.3, 'SKI', '1/7', score=score, k=k)
+        pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize('score', [None, 'CADD'])
+@pytest.mark.parametrize('k', [1, 2])
+def test_streaming_matches_in_memory(score, k):
+    rng = random.Random(k)
+    for trial in range(40):
+        # numeric sample names and exons check the chunks are read with the same types as the whole file
+        samples = ['100', '101', '102', '7'] if trial % 2 else ['s1', 's2', '101']
+        csv = random_variants(rng, rng.randint(1, 80), samples).to_csv(index=False)
+        all_vars = pd.read_csv(io.StringIO(csv), dtype={'Symbol': str, 'Exon': str})
+        most_dam = all_vars.drop_duplicates('Sample')
+        expected = nmd.next_most_damaging(most_dam.copy(), all_vars, score=score, top_k=k)
+        result = nmd.next_most_damaging_from_file(most_dam.copy(), io.StringIO(csv), score=score, top_k=k,
+                                                  chunksize=rng.randint(1, 10))
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
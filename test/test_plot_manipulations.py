@@ -0,0 +1,100 @@
+''' Checks of RoundToSigFigs against rounding the decimal representation of
+    each value
+'''
+import numpy as np
+import pytest
+from snsTools.plot_manipulations import RoundToSigFigs
+
+
+def reference(x, sigfigs, dtype=np.float64):
+    # the correctly rounded value of each element
+    return np.array([float('{:.{}g}'.format(float(v), sigfigs)) for v in x.reshape(-1)], dtype=dtype).reshape(x.shape)
+
+
+def random_values(n, low, high, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.uniform(-1, 1, n) * 10.0 ** rng.uniform(low, high, n)
+
+
+@pytest.mark.parametrize('sigfigs', [1, 2, 3, 6])
+def test_matches_reference(sigfigs):
+    x = random_values(5000, -5, 5)
+    np.testing.assert_array_equal(RoundToSigFigs(x, sigfigs), reference(x, sigfigs))
+
+
+@pytest.mark.parametrize('sigfigs', [1, 3, 6])
+def test_extreme_exponents_within_two_ulp(sigfigs):
+    # subnormal values lose precision when scaled, large exponents when divided
+    x = np.concatenate([random_values(2000, -300, 300), random_values(500, -322, -300), [5e-324, -1.234e-310]])
+    expected = reference(x, sigfigs)
+    np.testing.assert_array_max_ulp(RoundToSigFigs(x, sigfigs), expected, maxulp=2)
+
+
+def decimal_ties(x, sigfigs):
+    # the decimals half way between two values with sigfigs significant figures, as floats
+    ties = []
+    for v in x:
+        mantissa, exponent = '{:.{}e}'.format(v, sigfigs - 1).split('e')
+        ties.append(float(mantissa + ('' if '.' in mantissa else '.') + '5e' + exponent))
+    return np.array(ties)
+
+
+@pytest.mark.parametrize('sigfigs', [1, 2, 4, 15])
+def test_near_ties_match_reference(sigfigs):
+    # the float of a decimal tie is slightly above or below it, and exact ties round half to even
+    ties = decimal_ties(random_values(2000, -6, 6, seed=sigfigs), sigfigs)
+    np.testing.assert_array_equal(RoundToSigFigs(ties, sigfigs), reference(ties, sigfigs))
+
+    # the powers of ten are no longer exact, so the division by them can be a unit in the last place out
+    ties = decimal_ties(random_values(2000, -280, 290, seed=sigfigs), sigfigs)
+    np.testing.assert_array_max_ulp(RoundToSigFigs(ties, sigfigs), reference(ties, sigfigs), maxulp=1)
+
+
+def test_rounds_to_nearest():
+    # the original rounded 978.74 to 980 with three significant figures
+    np.testing.assert_array_equal(RoundToSigFigs(np.array([978.74, 0.0012345, -45.55, 1.5, 2.675]), 3),
+                                  [979, 0.00123, -45.5, 1.5, 2.67])
+    np.testing.assert_array_equal(RoundToSigFigs(np.array([0.125, 0.375, 12500.0]), 2), [0.12, 0.38, 12000])
+    assert RoundToSigFigs(978.74, 2) == 980
+
+
+def test_special_values_unchanged():
+    x = np.array([0.0, -0.0, np.nan, np.inf, -np.inf])
+    result = RoundToSigFigs(x, 2)
+    np.testing.assert_array_equal(result, x)
+    assert np.signbit(result[1])
+
+
+@pytest.mark.parametrize('sigfigs', [1, 3, 6])
+def test_float32_keeps_dtype(sigfigs):
+    x = random_values(5000, -30, 30).astype(np.float32)
+    result = RoundToSigFigs(x, sigfigs)
+    assert result.dtype == np.float32
+    np.testing.assert_array_equal(result, reference(x, sigfigs, np.float32))
+
+
+def test_integers_round_as_float64():
+    result = RoundToSigFigs(np.array([12345, -678]), 2)
+    assert result.dtype == np.float64
+    np.testing.assert_array_equal(result, [12000, -680])
+
+
+def test_out_in_place_and_chunks():
+    x = random_values(1000, -10, 10).reshape(20, 50)
+    expected = RoundToSigFigs(x, 4)
+    np.testing.assert_array_equal(RoundToSigFigs(x, 4, chunksize=7), expected)
+
+    result = RoundToSigFigs(x, 4, out=x)
+    assert result is x
+    np.testing.assert_array_equal(x, expected)
+
+
+def test_invalid_arguments():
+    with pytest.raises(TypeError):
+        RoundToSigFigs(1.0, 2.0)
+    with pytest.raises(ValueError):
+        RoundToSigFigs(1.0, 0)
+    with pytest.raises(TypeError):
+        RoundToSigFigs(np.array([1 + 1j]), 2)
+    with pytest.raises(ValueError):
+        RoundToSigFigs(np.ones(4), 2, out=np.ones((4, 2))[:, 0])